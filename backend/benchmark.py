@@ -0,0 +1,274 @@
+'''
+Load benchmark for the trivia API.
+
+Fills a local database with synthetic questions, then drives every read
+endpoint through the Flask test client or a real threaded WSGI server and
+prints throughput and p50/p95/p99 latency per endpoint as JSON.
+
+    python benchmark.py --sizes 10000,100000,1000000 --concurrency 16
+    python benchmark.py --mode wsgi --output bench.json
+    python benchmark.py --baseline bench.json --max-regression 0.2
+
+Each size gets its own SQLite file under --workdir unless --database-url
+is given; that database is DROPPED and refilled for every size.
+'''
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.importer import import_questions
+from flaskr.migrations import MIGRATIONS_TABLE, upgrade
+from models import db, Category
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports']
+WORDS = ['which', 'title', 'river', 'painter', 'planet', 'king', 'film',
+         'team', 'element', 'city', 'novel', 'war', 'ocean', 'composer',
+         'mountain', 'record', 'island', 'empire', 'museum', 'league']
+SEARCH_TERMS = ['title', 'river', 'planet king', 'museum']
+
+
+def synthetic_questions(count, seed=0):
+    rng = random.Random(seed)
+    for number in range(count):
+        words = rng.sample(WORDS, 6)
+        yield {
+            'question': '{} {}?'.format(' '.join(words), number),
+            'answer': rng.choice(WORDS).title(),
+            'category': rng.randint(1, len(CATEGORIES)),
+            'difficulty': rng.randint(1, 5)
+        }
+
+
+def build_dataset(database_url, size):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+    with app.app_context():
+        db.drop_all()
+        # REBUILD THROUGH THE MIGRATIONS SO THE SEARCH INDEXES EXIST TOO
+        db.session.execute('DROP TABLE IF EXISTS question_counts')
+        db.session.execute('DROP TABLE IF EXISTS {}'.format(MIGRATIONS_TABLE))
+        db.session.commit()
+        upgrade(db.engine)
+        for type in CATEGORIES:
+            db.session.add(Category(type=type))
+        db.session.commit()
+        started = time.perf_counter()
+        report = import_questions(synthetic_questions(size), 10000)
+        elapsed = time.perf_counter() - started
+    return app, {'inserted': report.inserted, 'seconds': round(elapsed, 2)}
+
+
+'''
+workload
+    (name, method, path, body) requests, drawn at random by every worker
+'''
+
+
+def workload(size, rng):
+    pages = max(1, size // 10)
+    category = rng.randint(1, len(CATEGORIES))
+    choice = rng.randrange(6)
+    if choice == 0:
+        return ('categories', 'GET', '/categories', None)
+    if choice == 1:
+        return ('questions_page', 'GET',
+                '/questions?page={}'.format(rng.randint(1, pages)), None)
+    if choice == 2:
+        return ('questions_after_id', 'GET',
+                '/questions?after_id={}'.format(rng.randint(0, size)), None)
+    if choice == 3:
+        return ('category_questions', 'GET',
+                '/categories/{}/questions?page={}'.format(
+                    category, rng.randint(1, max(1, pages // 6))), None)
+    if choice == 4:
+        return ('search', 'POST', '/questions',
+                {'searchTerm': rng.choice(SEARCH_TERMS)})
+    return ('quizzes', 'POST', '/quizzes', {
+        'previous_questions': [rng.randint(1, size) for _ in range(5)],
+        'quiz_category': {'id': rng.choice([0, category])}})
+
+
+class TestClientDriver(object):
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, body):
+            response = client.open(path, method=method, json=body)
+            return response.status_code
+        return send
+
+    def close(self):
+        pass
+
+
+class WSGIDriver(object):
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def session(self):
+        port = self.server.server_port
+
+        def send(method, path, body):
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            return response.status
+        return send
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(samples, fraction):
+    # NEAREST-RANK PERCENTILE OF SORTED SAMPLES
+    if not samples:
+        return None
+    index = max(0, int(round(fraction * len(samples) + 0.5)) - 1)
+    return samples[min(index, len(samples) - 1)]
+
+
+def run_load(driver, size, requests, concurrency, seed=0):
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        send = driver.session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            name, method, path, body = workload(size, rng)
+            started = time.perf_counter()
+            try:
+                status = send(method, path, body)
+            except Exception:
+                status = None
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.setdefault(name, []).append(elapsed)
+                if status is None or status >= 500:
+                    errors[name] = errors.get(name, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,))
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    endpoints = {}
+    for name, samples in sorted(latencies.items()):
+        samples.sort()
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': errors.get(name, 0),
+            'throughput_rps': round(len(samples) / wall, 1),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        }
+    return {
+        'requests': requests,
+        'seconds': round(wall, 3),
+        'throughput_rps': round(requests / wall, 1),
+        'endpoints': endpoints
+    }
+
+
+def regressions(result, baseline, max_regression):
+    '''
+    endpoints whose p95 grew by more than max_regression over baseline
+    '''
+    found = []
+    for size, run in result['runs'].items():
+        old_run = baseline.get('runs', {}).get(size)
+        if old_run is None:
+            continue
+        for name, stats in run['load']['endpoints'].items():
+            old = old_run['load']['endpoints'].get(name)
+            if old and stats['p95_ms'] > old['p95_ms'] * (1 + max_regression):
+                found.append('{} {}: p95 {}ms -> {}ms'.format(
+                    size, name, old['p95_ms'], stats['p95_ms']))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=['client', 'wsgi'],
+                        default='client')
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--workdir', default=tempfile.gettempdir())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    result = {
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'runs': {}
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        database_url = args.database_url or 'sqlite:///{}'.format(
+            os.path.join(args.workdir, 'trivia-bench-{}.db'.format(size)))
+        app, load_report = build_dataset(database_url, size)
+        driver = (WSGIDriver if args.mode == 'wsgi' else TestClientDriver)(
+            app)
+        try:
+            load = run_load(driver, size, args.requests, args.concurrency,
+                            args.seed)
+        finally:
+            driver.close()
+        result['runs'][str(size)] = {'dataset': load_report, 'load': load}
+        print('{} questions: {} req/s'.format(size, load['throughput_rps']),
+              file=sys.stderr)
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(result, json.load(file), args.max_regression)
+        for line in found:
+            print('REGRESSION ' + line, file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,36 +1,75 @@
 import os
-from flask import Flask, request, abort, jsonify, render_template, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
+import click
+from flask import Flask, request, abort, render_template, redirect, url_for, Response, stream_with_context
 from flask_cors import CORS
-import random
 # from dotenv import load_dotenv
-from models import setup_db, Question, Category
+from models import (
+    db, engine_setting, is_sqlite_memory, setup_db, insert_all, delete_all,
+    Question)
+from .pagination import paginate_questions
+from .cache import category_cache
+from .quiz import QUIZ_MAX_COUNT, parse_difficulty, quiz_sampler
+from .stats import question_stats
+from .admission import init_admission
+from .compression import init_compression
+from .conditional import conditional
+from .export import EXPORT_FORMATS, export_rows, export_chunks
+from .grading import answer_index, parse_aliases, without_answer
+from .metrics import init_metrics
+from .migrations import db_cli, upgrade
+from .preload import warm_caches
+from .replicas import init_replicas
+from .importer import (
+    IMPORT_BATCH, import_questions, load_psql_seed, parse_rows, validate_row)
+from .serialize import json_response
+from .snapshot import init_snapshot, snapshot_command
+from .search import question_search
+from .sessions import QuizSession, new_token, session_store_from_config
 
 # load_dotenv()
 
-QUESTIONS_PER_PAGE = 10
 
-
-def paginate_questions(request, group):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in group]
-    current_questions = questions[start:end]
-
-    return current_questions
+def wants_minimal(request):
+    # ?return=minimal SKIPS RE-LISTING QUESTIONS AFTER A WRITE
+    return request.args.get('return') == 'minimal'
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        QUIZ_SESSION_STORE=os.environ.get('QUIZ_SESSION_STORE', 'memory'),
+        QUIZ_HIDE_ANSWERS=os.environ.get('QUIZ_HIDE_ANSWERS', '').lower() in (
+            '1', 'true', 'yes', 'on'),
+        SNAPSHOT_DIR=os.environ.get('SNAPSHOT_DIR'),
+        SNAPSHOT_GZIP=os.environ.get('SNAPSHOT_GZIP', '').lower() in (
+            '1', 'true', 'yes', 'on'),
+        PRELOAD_CACHES=os.environ.get('PRELOAD_CACHES', '').lower() in (
+            '1', 'true', 'yes', 'on'))
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     setup_db(app)
+    # THE SCHEMA IS MIGRATED SEPARATELY, EXCEPT FOR AN IN-MEMORY DATABASE
+    # THAT NOTHING ELSE COULD EVER MIGRATE
+    if engine_setting(app, 'DB_AUTO_UPGRADE') or is_sqlite_memory(
+            app.config['SQLALCHEMY_DATABASE_URI']):
+        upgrade(db.get_engine(app))
+    # A NEW APP MAY BE BOUND TO A DIFFERENT DB, DROP IN-PROCESS CACHES
+    category_cache.invalidate()
+    quiz_sampler.invalidate()
+    answer_index.invalidate()
+    quiz_sessions = session_store_from_config(app.config)
+    question_search.configure(app)
 
     '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
   '''
     cors = CORS(app, resources={r"/*": {"origins": "*"}})
+    init_metrics(app)
+    init_admission(app)
+    init_replicas(app)
+    init_compression(app)
+    init_snapshot(app)
 
     '''
   @TODO: Use the after_request decorator to set Access-Control-Allow
@@ -50,24 +89,41 @@ def create_app(test_config=None):
   for all available categories.
   '''
     @app.route('/categories')
+    @conditional
     def get_categories():
         try:
-            # RETRIEVE ALL CATEGORIES FROM DB
-            categories = Category.query.all()
-            # print(categories)
-            # FORMAT LIST OF CATEGORIES TO JSON TYPE
-            formated_categories = [category.format()
-                                   for category in categories]
-            # print('formated_categories:', formated_categories)
-            # RETURN LIST OF CATEGORIES TYPES
-            category_type = [category['type']
-                             for category in formated_categories]
-            # print('category_type:', category_type)
-
-            return jsonify({'categories': category_type})
+            # RETRIEVE LIST OF CATEGORIES TYPES FROM CACHE
+            category_type = category_cache.types()
+
+            return json_response({'categories': category_type})
         except BaseException:
             abort(404)
 
+    '''
+  Question counts per category and per difficulty, read from the
+  in-process counters instead of counting rows.
+  '''
+    @app.route('/stats')
+    @conditional
+    def get_stats():
+        categories = [{
+            'id': category['id'],
+            'type': category['type'],
+            'total_questions': question_stats.total(category=category['id']),
+            'difficulties': [
+                {'difficulty': difficulty, 'total_questions': count}
+                for difficulty, count
+                in question_stats.difficulties(category['id'])]
+        } for category in category_cache.formatted()]
+        return json_response({
+            'success': True,
+            'total_questions': question_stats.total(),
+            'categories': categories,
+            'difficulties': [
+                {'difficulty': difficulty, 'total_questions': count}
+                for difficulty, count in question_stats.difficulties()]
+        })
+
     '''
   @TODO:
   Create an endpoint to handle GET requests for questions,
@@ -81,38 +137,75 @@ def create_app(test_config=None):
   Clicking on the page numbers should update the questions.
   '''
     @app.route('/questions')
+    @conditional
     def get_questions():
         try:
-            current_category = []
-
-            # RETRIEVE ALL QUESTIONS FROM DB
-            group = Question.query.order_by(Question.id).all()
-            # PAGENATE QUESTIONS
-            current_questions = paginate_questions(request, group)
-            # print('current_questions', current_questions)
-            if len(current_questions) == 0:
+            # RETRIEVE ONE PAGE OF QUESTIONS FROM DB
+            page = paginate_questions(
+                request, Question.query, total=question_stats.total())
+            # print('current_questions', page.questions)
+            if len(page.questions) == 0:
                 abort(404)
             else:
-                # RETRIEVE ALL CATEGORIES FROM DB
-                categories = Category.query.all()
-                # FORMATT CATEGORY LIST
-                formated_categories = [category.format()
-                                       for category in categories]
-                # RETURN LIST OF ATEGORIES TYPES
-                category_type = [category['type']
-                                 for category in formated_categories]
+                # RETRIEVE LIST OF CATEGORIES TYPES FROM CACHE
+                category_type = category_cache.types()
                 # GET CURRENT ATEGORIES DEPENDING ON QUESTIONS SHOWING ON PAGE
-                for question in current_questions:
-                    current_category.append(question['category'])
-                return ({
-                    'questions': current_questions,
-                    'total_questions': len(group),
+                return json_response({
+                    'questions': page.questions,
+                    'total_questions': page.total,
                     'categories': category_type,
-                    'current_category': current_category
+                    'current_category': page.current_category(),
+                    'next_after_id': page.next_after_id
                 })
         except BaseException:
             abort(404)
 
+    '''
+  Stream the whole question bank, or one category / difficulty of it,
+  as NDJSON or CSV without paging through /questions.
+  '''
+    @app.route('/questions/export')
+    def export_questions():
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            abort(400)
+        # A FILTER THAT IS NOT A NUMBER MUST NOT EXPORT THE WHOLE TABLE
+        category = request.args.get('category', None)
+        difficulty = request.args.get('difficulty', None)
+        try:
+            category = None if category is None else int(category)
+            difficulty = None if difficulty is None else int(difficulty)
+        except ValueError:
+            abort(400)
+        # ROWS ARE READ FROM A SERVER-SIDE CURSOR WHILE THE BODY IS SENT
+        rows = export_rows(category, difficulty)
+        response = Response(
+            stream_with_context(export_chunks(export_format, rows)),
+            mimetype=EXPORT_FORMATS[export_format])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=questions.{}'.format(export_format)
+        return response
+
+    '''
+  Load a question pack from a streamed NDJSON or CSV body in large batches.
+  '''
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions_endpoint():
+        import_format = request.args.get('format', None)
+        if import_format is None:
+            import_format = 'csv' if request.mimetype == 'text/csv' \
+                else 'ndjson'
+        if import_format not in EXPORT_FORMATS:
+            abort(400)
+        batch_size = request.args.get('batch_size', IMPORT_BATCH, type=int)
+        if batch_size < 1:
+            abort(400)
+        # READ THE BODY LINE BY LINE INSTEAD OF BUFFERING IT
+        lines = (line.decode('utf-8') for line in request.stream)
+        report = import_questions(
+            parse_rows(import_format, lines), batch_size)
+        return json_response(dict(success=True, **report.format()))
+
     '''
   @TODO:
   Create an endpoint to DELETE question using a question ID.
@@ -132,28 +225,24 @@ def create_app(test_config=None):
                 formatted_question = question.format()
                 # DELETE QUETION FROM DB
                 question.delete()
+                if wants_minimal(request):
+                    return json_response({
+                        'success': True,
+                        'deleted': formatted_question['id']
+                    })
 
-                current_category = []
-                # RETRIEVE ALL QUESTIONS FROM DB
-                group = Question.query.order_by(Question.id).all()
-                # PAGENATE QUESTIONS
-                current_questions = paginate_questions(request, group)
-                # print('current_questions', current_questions)
-                # RETRIEVE ALL CATEGORIES FROM DB
-                categories = Category.query.all()
-                # FORMAT LIST OF ATEGORIES TO JSON TYPE
-                formated_categories = [category.format()
-                                       for category in categories]
-                # RETURN LIST OF CATEGORIES TYPES
-                for question in current_questions:
-                    current_category.append(question['category'])
-                return jsonify({
+                # RETRIEVE ONE PAGE OF QUESTIONS FROM DB
+                page = paginate_questions(
+                    request, Question.query, total=question_stats.total())
+                # RETRIEVE FORMATTED CATEGORIES FROM CACHE
+                formated_categories = category_cache.formatted()
+                return json_response({
                     'success': True,
                     'deleted': formatted_question['id'],
-                    'questions': current_questions,
-                    'total_questions': len(group),
+                    'questions': page.questions,
+                    'total_questions': page.total,
                     'categories': formated_categories,
-                    'current_category': current_category
+                    'current_category': page.current_category()
                 })
         except BaseException:
             # db.session.rollback()
@@ -192,27 +281,19 @@ def create_app(test_config=None):
         difficulty = body.get("difficulty", None)
         category = body.get("category", None)
         q = body.get('searchTerm', None)
+        search_mode = body.get('searchMode', 'substring')
 
         try:
             # IF REQUEST BODY HAS SearchTerm:
             if q:
-                current_category = []
-                # print(q)
-                # RETRIVE ALL QUESTIONS THAT MATCH SEARCH TERM FROM DB
-                group = Question.query.filter(
-                    Question.question.ilike(
-                        '%{}%'.format(q))).all()
-                # PAGENATE RETRIEVED QUESTIONS
-                current_questions = paginate_questions(request, group)
-                # LIST OF CURRENT CATEGORIES BASED ON DISPLAYED QUESTIONS
-                for question in current_questions:
-                    current_category.append(question['category'])
-                # print('questions', current_questions,'total_questions', len(group),'current_category', current_category)
-
-                return jsonify({
-                    'questions': current_questions,
-                    'total_questions': len(group),
-                    'current_category': current_category
+                # RETRIVE ONE PAGE OF QUESTIONS THAT MATCH SEARCH TERM
+                page = question_search.search(request, q, search_mode)
+
+                return json_response({
+                    'questions': page.questions,
+                    'total_questions': page.total,
+                    'current_category': page.current_category(),
+                    'next_after_id': page.next_after_id
                 })
             else:
                 # IF REQUEST BODY HAS NEW QUESTION INFO:
@@ -226,28 +307,94 @@ def create_app(test_config=None):
                         question=question,
                         answer=answer,
                         difficulty=difficulty,
-                        category=category)
+                        category=category,
+                        answer_aliases=parse_aliases(
+                            body.get("answer_aliases")))
                     # INSERT NEW QUESTION INTO DB
                     new_question.insert()
-
-                    current_category = []
-                    # RETRIEVE ALL QUESTIONS FROM DB
-                    group = Question.query.order_by(Question.id).all()
-                    # PAGENATE QUESTIONS
-                    current_questions = paginate_questions(request, group)
-                    # RETURN LIST OF CURRENT CATEGORIES BASED ON DISPLAYED
-                    # QUESTIONS
-                    for question in current_questions:
-                        current_category.append(question['category'])
-                    return jsonify({
+                    if wants_minimal(request):
+                        return json_response({
+                            'success': True,
+                            'created': new_question.id
+                        })
+
+                    # RETRIEVE ONE PAGE OF QUESTIONS FROM DB
+                    page = paginate_questions(
+                        request, Question.query, total=question_stats.total())
+                    return json_response({
                         'created': new_question.id,
-                        'questions': current_questions,
-                        'total_questions': len(group),
-                        'current_category': current_category
+                        'questions': page.questions,
+                        'total_questions': page.total,
+                        'current_category': page.current_category()
                     })
         except BaseException:
             abort(422)
 
+    '''
+  Batch writes: each request is one transaction, so either every
+  question is created or deleted, or none is.
+  '''
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions():
+        try:
+            ids = set(int(id) for id in request.get_json()['ids'])
+        except BaseException:
+            abort(400)
+        # RETRIEVE ALL REQUESTED QUESTIONS IN ONE QUERY
+        questions = Question.query.filter(Question.id.in_(ids)).all()
+        if not ids or len(questions) != len(ids):
+            abort(422)
+        try:
+            delete_all(questions)
+        except BaseException:
+            abort(422)
+        deleted = sorted(ids)
+        if wants_minimal(request):
+            return json_response({'success': True, 'deleted': deleted})
+
+        page = paginate_questions(
+            request, Question.query, total=question_stats.total())
+        return json_response({
+            'success': True,
+            'deleted': deleted,
+            'questions': page.questions,
+            'total_questions': page.total,
+            'categories': category_cache.formatted(),
+            'current_category': page.current_category()
+        })
+
+    @app.route('/questions/batch', methods=['POST'])
+    def create_questions():
+        try:
+            rows = request.get_json()['questions']
+            if not rows:
+                abort(422)
+            new_questions = []
+            for row in rows:
+                mapping = validate_row(row)
+                new_questions.append(Question(
+                    question=mapping['question'],
+                    answer=mapping['answer'],
+                    difficulty=mapping['difficulty'],
+                    category=mapping['category'],
+                    answer_aliases=mapping['answer_aliases']))
+            insert_all(new_questions)
+        except BaseException:
+            abort(422)
+        created = [question.id for question in new_questions]
+        if wants_minimal(request):
+            return json_response({'success': True, 'created': created})
+
+        page = paginate_questions(
+            request, Question.query, total=question_stats.total())
+        return json_response({
+            'success': True,
+            'created': created,
+            'questions': page.questions,
+            'total_questions': page.total,
+            'current_category': page.current_category()
+        })
+
     '''
   @TODO:
   Create a GET endpoint to get questions based on category.
@@ -257,32 +404,27 @@ def create_app(test_config=None):
   category to be shown.
   '''
     @app.route('/categories/<int:id>/questions')
+    @conditional
     def get_questions_by_category(id):
         try:
-            # RETRIEVE ALL CATEGORIES FROM DB
-            categories = Category.query.all()
-            # FORMAT LIST OF CATEGORIES TO JSON TYPE
-            formated_categories = [category.format()
-                                   for category in categories]
-            # RETURN LIST OF ATEGORIES TYPES
-            category_type = [category['type']
-                             for category in formated_categories]
-            # RETRIEVE CATEGORY USING ID FROM DB
-            current_category = Category.query.filter_by(
-                id=id).first_or_404().format()
+            # RETRIEVE LIST OF CATEGORIES TYPES FROM CACHE
+            category_type = category_cache.types()
+            # RETRIEVE CATEGORY TYPE USING ID FROM CACHE
+            current_category = category_cache.type_of(id)
             # IF ID IS NOT VALID
-            if current_category == 404:
+            if current_category is None:
                 abort(404)
             else:
-                # RETRIEVE ALL CATEGORIES FROM DB
-                group = Question.query.filter_by(category=id).all()
-                # PAGENATE QUESTIONS
-                current_questions = paginate_questions(request, group)
-                return jsonify({
+                # RETRIEVE ONE PAGE OF QUESTIONS IN CATEGORY FROM DB
+                page = paginate_questions(
+                    request, Question.query.filter_by(category=id),
+                    total=question_stats.total(category=id))
+                return json_response({
                     'categories': category_type,
-                    'current_category': current_category['type'],
-                    'questions': current_questions,
-                    'total_questions': len(group)
+                    'current_category': current_category,
+                    'questions': page.questions,
+                    'total_questions': page.total,
+                    'next_after_id': page.next_after_id
                 })
         except BaseException:
             abort(404)
@@ -303,39 +445,154 @@ def create_app(test_config=None):
         try:
             # RETRIEVE REQUEST BODY IN JSON TYPE
             body = request.get_json()
-            # print('body:', body)
             # ASSIGN REQUEST BODYINFO TO VARIABLES
-            previous_questions = body.get("previous_questions")
+            previous_questions = [int(id) for id in
+                                  body.get("previous_questions", [])]
             quiz_category = body.get("quiz_category")
-            # print('quiz_category', quiz_category)
+            # ID 0 MEANS THE PLAYER CHOSE ALL CATEGORIES
             quiz_category_id = int(quiz_category['id'])
-            # print('quiz_category_id:', quiz_category_id)
-            # IF PLAYER CHOSES ALL CATEGORIES
-            if quiz_category == 0:
-                # RETRIEVE ALL QUESTIONS FOM DB
-                get_questions = Question.query.all()
-                # print('get_questions', get_questions, len(get_questions))
-                # RANDOMLY CHOSE QUESTION TO DISPLAY IN JSON FORMAT
-                random_question = random.choice(get_questions).format()
-                # IF PLAYES CHOSES CATEGORY
-            else:
-                # print('previous_questions', previous_questions, 'quiz_category', quiz_category)
-                # RETRIEVE CATEGORY THAT MATCH REQUEST ID FORM DB
-                # get_category = Category.query.filter_by(id=quiz_category_id).first_or_404()
-                # RETRIEVE ALL QUESTIONS UNDER THE REQUESTED CATEGORY FROM DB
-                get_questions = Question.query.filter_by(
-                    category=quiz_category_id).all()
-                # print('get_questions', get_questions, len(get_questions))
-                # RANDOMLY CHOSE QUESTION TO DISPLAY IN JSON FORMAT
-                random_question = random.choice(get_questions).format()
-                # print('random_question', random_question)
-                # MAKE SURE THE RANDOMLY CHOSEN QUESTION IS NOT INCLUDED IN
-                # PREVIOUS QUESTION TO PREVENT REPEATING
-            if random_question['id'] in previous_questions:
-                return
+            # count ASKS FOR SEVERAL QUESTIONS, plan FOR A WHOLE GAME
+            count = body.get("count", None)
+            if body.get("plan"):
+                count = QUIZ_MAX_COUNT
+            elif count is not None:
+                count = int(count)
+                if not 1 <= count <= QUIZ_MAX_COUNT:
+                    raise ValueError('count out of range')
+            # difficulty LIMITS THE DRAW, ramp RAISES IT AS THE QUIZ GOES ON
+            difficulty = parse_difficulty(body)
+            # hide_answers LEAVES GRADING TO POST /quizzes/grade
+            hide = bool(body.get(
+                "hide_answers", app.config['QUIZ_HIDE_ANSWERS']))
         except BaseException:
             abort(400)
-        return jsonify({'question': random_question})
+        if count is not None:
+            # DRAW count QUESTIONS AND READ THEM IN ONE QUERY
+            questions = quiz_sampler.next_questions(
+                quiz_category_id, previous_questions, count, difficulty)
+            if hide:
+                questions = [without_answer(question)
+                             for question in questions]
+            return json_response({
+                'questions': questions,
+                'question': questions[0] if questions else None,
+                'exhausted': len(questions) < count
+            })
+        # DRAW ONE QUESTION THAT IS NOT IN PREVIOUS QUESTIONS
+        question = quiz_sampler.next_question(
+            quiz_category_id, previous_questions, difficulty)
+        if question is None:
+            # NOTHING LEFT TO PLAY IN THIS CATEGORY
+            return json_response({'question': None, 'exhausted': True})
+        return json_response({
+            'question': without_answer(question) if hide else question,
+            'exhausted': False
+        })
+
+    '''
+  Grade a batch of answers, a whole game at once, against the in-process
+  answer index instead of shipping answers to the client.
+  '''
+    @app.route('/quizzes/grade', methods=['POST'])
+    def grade_answers():
+        try:
+            body = request.get_json()
+            submissions = [(int(answer['id']), str(answer['answer']))
+                           for answer in body['answers']]
+            if not 1 <= len(submissions) <= QUIZ_MAX_COUNT:
+                raise ValueError('answers out of range')
+        except BaseException:
+            abort(400)
+        results = answer_index.grade(submissions)
+        return json_response({
+            'success': True,
+            'results': results,
+            'score': sum(1 for result in results if result['correct']),
+            'total': len(results)
+        })
+
+    '''
+  Quiz sessions keep the played question ids on the server, so a client
+  only sends its session token instead of the whole previous_questions list.
+  '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        try:
+            body = request.get_json()
+            quiz_category_id = int(body.get("quiz_category")['id'])
+        except BaseException:
+            abort(400)
+        session = QuizSession(new_token(), quiz_category_id)
+        quiz_sessions.put(session)
+        return json_response({
+            'success': True,
+            'session': session.token,
+            'quiz_category': quiz_category_id
+        })
+
+    @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+    def next_session_question(token):
+        session = quiz_sessions.get(token)
+        if session is None:
+            abort(404)
+        # DRAW ONE QUESTION THE SESSION HAS NOT PLAYED YET
+        question = quiz_sampler.next_question(
+            session.category, session.played)
+        if question is None:
+            quiz_sessions.put(session)
+            return json_response({
+                'question': None,
+                'exhausted': True,
+                'played': len(session.played)
+            })
+        session.played.add(question['id'])
+        quiz_sessions.put(session)
+        if app.config['QUIZ_HIDE_ANSWERS']:
+            question = without_answer(question)
+        return json_response({
+            'question': question,
+            'exhausted': False,
+            'played': len(session.played)
+        })
+
+    @app.route('/quizzes/sessions/<token>', methods=['DELETE'])
+    def end_quiz_session(token):
+        if quiz_sessions.get(token) is None:
+            abort(404)
+        quiz_sessions.delete(token)
+        return json_response({'success': True, 'deleted': token})
+
+    app.cli.add_command(db_cli)
+    app.cli.add_command(snapshot_command)
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'import_format', default=None,
+                  type=click.Choice(['ndjson', 'csv', 'psql']),
+                  help='Defaults to the file extension.')
+    @click.option('--batch-size', default=IMPORT_BATCH, show_default=True)
+    def import_questions_command(path, import_format, batch_size):
+        """Bulk load questions from NDJSON, CSV or a pg_dump seed file."""
+        if import_format is None:
+            extension = os.path.splitext(path)[1].lstrip('.')
+            import_format = extension if extension in (
+                'csv', 'psql') else 'ndjson'
+
+        def echo_batch(batch):
+            click.echo('batch: {rows} rows in {seconds}s '
+                       '({rows_per_second} rows/s)'.format(**batch))
+
+        with open(path, encoding='utf-8', newline='') as lines:
+            if import_format == 'psql':
+                report = load_psql_seed(lines, batch_size, echo_batch)
+            else:
+                report = import_questions(
+                    parse_rows(import_format, lines), batch_size, echo_batch)
+        click.echo('inserted {} questions, rejected {}'.format(
+            report.inserted, report.rejected))
+        for reject in report.rejects:
+            click.echo('  line {line}: {error}'.format(**reject))
+
     '''
   @TODO:
   Create error handlers for all expected errors
@@ -343,42 +600,46 @@ def create_app(test_config=None):
   '''
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "error": 422,
             "message": "unprocessable"
-        }), 422
+        }, 422)
 
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "error": 400,
             "message": "bad request"
-        }), 400
+        }, 400)
 
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "error": 404,
             "message": "content not found"
-        }), 404
+        }, 404)
 
         @app.errorhandler(405)
         def method_not_allowed(error):
-            return jsonify({
+            return json_response({
                 "success": False,
                 "error": 405,
                 "message": "method not allowed"
-            }), 405
+            }, 405)
 
             @app.errorhandler(500)
             def method_not_allowed(error):
-                return jsonify({
+                return json_response({
                     "success": False,
                     "error": 500,
                     "message": "internal server error"
-                }), 500
+                }, 500)
+
+    if app.config['PRELOAD_CACHES']:
+        # LOAD ONCE IN THE MASTER, WORKERS SHARE THE PAGES AFTER THE FORK
+        warm_caches(app)
 
     return app
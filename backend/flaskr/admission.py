@@ -0,0 +1,181 @@
+import asyncio
+import math
+import threading
+import time
+
+from flask import g, request
+
+from .metrics import Counter, Gauge, metrics_registry
+from .serialize import json_response
+
+# CLASS -> (RUNNING AT ONCE, WAITING AT MOST, SECONDS A REQUEST MAY WAIT)
+ADMISSION_LIMITS = {
+    'quiz': (16, 64, 1.0),
+    'list': (8, 32, 2.0),
+    'search': (4, 16, 2.0),
+    'writes': (4, 16, 5.0),
+}
+ENDPOINT_CLASSES = {
+    'play': 'quiz',
+    'start_quiz_session': 'quiz',
+    'next_session_question': 'quiz',
+    'end_quiz_session': 'quiz',
+    'grade_answers': 'quiz',
+    'get_categories': 'list',
+    'get_stats': 'list',
+    'get_questions': 'list',
+    'get_questions_by_category': 'list',
+    'export_questions': 'list',
+    # POST /questions IS A SEARCH WHEN THE BODY HAS A searchTerm
+    'create_question': 'writes',
+    'create_questions': 'writes',
+    'delete_question': 'writes',
+    'delete_questions': 'writes',
+    'import_questions_endpoint': 'writes',
+}
+# HOW OFTEN AN ASYNC WAITER LOOKS FOR A FREE SLOT
+ASYNC_POLL_SECONDS = 0.005
+
+admission_running = Gauge(
+    'trivia_admission_running', 'Requests running, by endpoint class.')
+admission_waiting = Gauge(
+    'trivia_admission_waiting', 'Requests queued, by endpoint class.')
+admission_shed = Counter(
+    'trivia_admission_shed_total',
+    'Requests rejected with 503, by endpoint class and reason.')
+metrics_registry.collectors.extend(
+    [admission_running, admission_waiting, admission_shed])
+
+'''
+AdmissionLimiter
+    lets limit requests of one endpoint class run at once. up to queue
+    more wait for a slot, each for at most timeout seconds; a request
+    that finds the queue full, or whose wait runs out, is shed at once
+    instead of piling up behind the database.
+'''
+
+
+class AdmissionLimiter(object):
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(limit)
+        self.waiting = 0
+
+    def retry_after(self):
+        return max(1, int(math.ceil(self.timeout)))
+
+    def _shed(self, reason):
+        admission_shed.inc((('class', self.name), ('reason', reason)))
+        return False
+
+    def _enqueue(self):
+        with self._lock:
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+        admission_waiting.inc((('class', self.name),))
+        return True
+
+    def _dequeue(self):
+        with self._lock:
+            self.waiting -= 1
+        admission_waiting.inc((('class', self.name),), -1)
+
+    def _admitted(self):
+        admission_running.inc((('class', self.name),))
+        return True
+
+    def acquire(self):
+        '''
+        True once the request holds a slot, False when it was shed
+        '''
+        if self._slots.acquire(blocking=False):
+            return self._admitted()
+        if not self._enqueue():
+            return self._shed('queue_full')
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            self._dequeue()
+        if not acquired:
+            return self._shed('timeout')
+        return self._admitted()
+
+    async def acquire_async(self):
+        '''
+        acquire() for the event loop: waiting polls instead of blocking,
+        so a queued request never holds up the loop
+        '''
+        if self._slots.acquire(blocking=False):
+            return self._admitted()
+        if not self._enqueue():
+            return self._shed('queue_full')
+        deadline = time.monotonic() + self.timeout
+        try:
+            while not self._slots.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    return self._shed('timeout')
+                await asyncio.sleep(ASYNC_POLL_SECONDS)
+        finally:
+            self._dequeue()
+        return self._admitted()
+
+    def release(self):
+        admission_running.inc((('class', self.name),), -1)
+        self._slots.release()
+
+
+def endpoint_class(request):
+    if request.endpoint == 'create_question':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get('searchTerm'):
+            return 'search'
+    return ENDPOINT_CLASSES.get(request.endpoint)
+
+
+def overloaded_response(limiter):
+    response = json_response({
+        "success": False,
+        "error": 503,
+        "message": "service unavailable"
+    }, 503)
+    response.headers['Retry-After'] = str(limiter.retry_after())
+    return response
+
+
+'''
+init_admission(app)
+    one AdmissionLimiter per endpoint class, from ADMISSION_LIMITS
+    (overridable per class in app.config), kept in
+    app.extensions['admission'] for the ASGI entry point. a shed request
+    gets 503 with Retry-After; queue depth and shed counts are reported
+    at /metrics. ADMISSION_ENABLED = False turns it off.
+'''
+
+
+def init_admission(app):
+    if not app.config.get('ADMISSION_ENABLED', True):
+        return
+    limits = dict(ADMISSION_LIMITS, **app.config.get('ADMISSION_LIMITS', {}))
+    limiters = {name: AdmissionLimiter(name, *limit)
+                for name, limit in limits.items()}
+    app.extensions['admission'] = limiters
+
+    @app.before_request
+    def admit_request():
+        limiter = limiters.get(endpoint_class(request))
+        if limiter is None:
+            return None
+        if not limiter.acquire():
+            return overloaded_response(limiter)
+        g.admission = limiter
+
+    @app.teardown_request
+    def release_request(error=None):
+        limiter = g.pop('admission', None)
+        if limiter is not None:
+            limiter.release()
@@ -0,0 +1,459 @@
+'''
+ASGI entry point for the trivia API.
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 2
+
+Serves the same routes and JSON contracts as create_app. POST /quizzes,
+the hot path during quiz events, is handled natively: the draw comes
+from the in-memory quiz pools and the one question row is read with
+asyncpg (Postgres) or aiosqlite (SQLite file) when installed, so a
+waiting player holds no thread. Every other route runs the Flask app on
+a bounded thread pool sized to the database pool, with request and
+response bodies moved asynchronously.
+'''
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.request import pathname2url
+
+from werkzeug.datastructures import Headers
+
+from models import Question, db
+from . import create_app
+from .grading import without_answer
+from .quiz import parse_difficulty, quiz_sampler
+from .serialize import QUESTION_FIELDS, dumps, format_row, project_questions
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - asyncpg is optional
+    asyncpg = None
+
+try:
+    import aiosqlite
+except ImportError:  # pragma: no cover - aiosqlite is optional
+    aiosqlite = None
+
+ASGI_THREADS = 16
+# RESPONSE CHUNKS BUFFERED BETWEEN A STREAMING VIEW AND A SLOW CLIENT
+STREAM_BUFFER = 8
+CORS_HEADERS = [
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-allow-methods',
+     b'GET, PATCH, DELETE, OPTIONS, POST, PUT'),
+]
+QUESTION_BY_ID = 'SELECT {} FROM questions WHERE id = {}'
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode(
+            'utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(
+            scope.get('http_version', '1.1')),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value \
+                if key in environ else value
+    return environ
+
+
+def has_header(scope, wanted):
+    return any(name == wanted for name, _ in scope['headers'])
+
+
+'''
+QuestionReader
+    reads one question row by id without blocking the event loop. the
+    connection is opened once per event loop (normally at lifespan
+    startup); if a different loop asks, the old one is closed first.
+    without an async driver the read runs on the thread pool instead.
+'''
+
+
+class QuestionReader(object):
+    def __init__(self, app, executor):
+        self.app = app
+        self.executor = executor
+        self.uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self._loop = None
+        self._lock = None
+        self._connection = None
+        self._fields = ', '.join(QUESTION_FIELDS)
+
+    def driver(self):
+        if asyncpg is not None and self.uri.startswith('postgres'):
+            return 'asyncpg'
+        if aiosqlite is not None and self.uri.startswith('sqlite:///') \
+                and ':memory:' not in self.uri:
+            return 'aiosqlite'
+        return None
+
+    def sqlite_uri(self):
+        '''
+        the file the app's engine opens, resolved against the app root
+        rather than the working directory. mode=rw makes a missing file
+        an error instead of a new empty database.
+        '''
+        path = db.get_engine(self.app).url.database
+        return 'file:{}?mode=rw'.format(pathname2url(path))
+
+    async def _connect(self, driver):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A POOL OR CONNECTION BELONGS TO THE LOOP THAT OPENED IT
+            await self.close()
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # CONCURRENT FIRST REQUESTS MUST NOT OPEN TWO POOLS
+            if self._connection is None:
+                if driver == 'asyncpg':
+                    dsn = 'postgresql://' + self.uri.split('://', 1)[1]
+                    self._connection = await asyncpg.create_pool(dsn)
+                else:
+                    self._connection = await aiosqlite.connect(
+                        self.sqlite_uri(), uri=True)
+        return self._connection
+
+    async def open(self):
+        driver = self.driver()
+        if driver is not None:
+            await self._connect(driver)
+
+    def _fetch_sync(self, id):
+        with self.app.app_context():
+            return project_questions(Question.query).filter(
+                Question.id == id).first()
+
+    async def fetch(self, id):
+        driver = self.driver()
+        if driver is None:
+            row = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._fetch_sync, id)
+        elif driver == 'asyncpg':
+            pool = await self._connect(driver)
+            row = await pool.fetchrow(
+                QUESTION_BY_ID.format(self._fields, '$1'), id)
+        else:
+            connection = await self._connect(driver)
+            statement = QUESTION_BY_ID.format(self._fields, '?')
+            async with connection.execute(statement, (id,)) as cursor:
+                row = await cursor.fetchone()
+        return None if row is None else format_row(tuple(row))
+
+    async def close(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        if asyncpg is not None and isinstance(connection, asyncpg.Pool) \
+                and self._loop is not asyncio.get_running_loop():
+            # AN asyncpg POOL CANNOT BE AWAITED FROM ANOTHER LOOP
+            connection.terminate()
+        else:
+            await connection.close()
+
+
+class AsgiApp(object):
+    def __init__(self, app, threads=None):
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            threads or app.config.get('ASGI_THREADS', ASGI_THREADS))
+        self.reader = QuestionReader(app, self.executor)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] != 'http':
+            return
+        elif scope['method'] == 'POST' and scope['path'] == '/quizzes':
+            await self.play(scope, receive, send)
+        else:
+            await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.reader.open()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.reader.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def send_json(self, scope, send, payload, status=200,
+                        headers=()):
+        headers = [(b'content-type', b'application/json')] + \
+            CORS_HEADERS + list(headers)
+        if has_header(scope, b'origin'):
+            headers.append((b'access-control-allow-origin', b'*'))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        await send({'type': 'http.response.body', 'body': dumps(payload)})
+
+    def _draw(self, category, excluded, difficulty=None):
+        with self.app.app_context():
+            return quiz_sampler.draw(category, excluded, difficulty)
+
+    async def play(self, scope, receive, send):
+        '''
+        async twin of the /quizzes view in create_app for single draws
+        '''
+        raw_body = await read_body(receive)
+        try:
+            body = json.loads(raw_body)
+            previous_questions = [int(id) for id in
+                                  body.get("previous_questions", [])]
+            quiz_category_id = int(body.get("quiz_category")['id'])
+        except BaseException:
+            return await self.send_json(scope, send, {
+                "success": False,
+                "error": 400,
+                "message": "bad request"
+            }, 400)
+        if 'count' in body or 'plan' in body:
+            # BATCHES READ ALL THEIR ROWS IN ONE QUERY, LEAVE THEM TO FLASK
+            return await self.call_wsgi(scope, receive, send, raw_body)
+        try:
+            difficulty = parse_difficulty(body)
+            hide = bool(body.get(
+                "hide_answers", self.app.config['QUIZ_HIDE_ANSWERS']))
+        except (TypeError, ValueError):
+            return await self.send_json(scope, send, {
+                "success": False,
+                "error": 400,
+                "message": "bad request"
+            }, 400)
+        # SAME quiz LIMITER AS THE FLASK VIEWS, BATCHES ABOVE ARE ADMITTED
+        # BY FLASK ITSELF
+        limiter = self.app.extensions.get('admission', {}).get('quiz')
+        if limiter is not None and not await limiter.acquire_async():
+            return await self.send_json(scope, send, {
+                "success": False,
+                "error": 503,
+                "message": "service unavailable"
+            }, 503, [(b'retry-after', str(limiter.retry_after()).encode())])
+        try:
+            return await self.draw_question(
+                scope, send, quiz_category_id, previous_questions,
+                difficulty, hide)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    async def draw_question(self, scope, send, quiz_category_id,
+                            previous_questions, difficulty, hide=False):
+        loop = asyncio.get_running_loop()
+        excluded = set(previous_questions)
+        while True:
+            if quiz_sampler.fresh():
+                id = quiz_sampler.draw(quiz_category_id, excluded, difficulty)
+            else:
+                # ONLY A STALE POOL NEEDS THE DATABASE, LOAD IT OFF THE LOOP
+                id = await loop.run_in_executor(
+                    self.executor, self._draw, quiz_category_id, excluded,
+                    difficulty)
+            if id is None:
+                return await self.send_json(scope, send, {
+                    'question': None, 'exhausted': True})
+            question = await self.reader.fetch(id)
+            if question is not None:
+                if hide:
+                    question = without_answer(question)
+                return await self.send_json(scope, send, {
+                    'question': question, 'exhausted': False})
+            quiz_sampler.remove(id)
+
+    async def call_wsgi(self, scope, receive, send, body=None):
+        if body is None:
+            body = await read_body(receive)
+        environ = build_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(STREAM_BUFFER)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers]
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def run():
+            # THE WHOLE RESPONSE IS PRODUCED ON ONE THREAD, SO STREAMED
+            # VIEWS KEEP THEIR FLASK CONTEXT
+            iterable = None
+            try:
+                iterable = self.app.wsgi_app(environ, start_response)
+                for chunk in iterable:
+                    if chunk:
+                        put(chunk)
+                put(None)
+            except BaseException as error:
+                put(error)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+
+        worker = loop.run_in_executor(self.executor, run)
+        chunk = await chunks.get()
+        if isinstance(chunk, BaseException):
+            await worker
+            raise chunk
+        await send({'type': 'http.response.start',
+                    'status': started['status'],
+                    'headers': started['headers']})
+        while chunk is not None:
+            if isinstance(chunk, BaseException):
+                break
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': True})
+            chunk = await chunks.get()
+        await send({'type': 'http.response.body', 'body': b''})
+        await worker
+
+
+def create_asgi_app(test_config=None):
+    return AsgiApp(create_app(test_config))
+
+
+'''
+AsgiTestClient
+    the subset of Flask's test client used by test_flaskr.py, driving an
+    AsgiApp instead, so the same tests cover both serving modes. every
+    request runs on the client's own event loop between a lifespan
+    startup and the shutdown sent by close().
+'''
+
+
+class AsgiResponse(object):
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+class AsgiTestClient(object):
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self._lifespan = None
+        self.loop.run_until_complete(self._start())
+
+    async def _start(self):
+        self._inbox = asyncio.Queue()
+        self._outbox = asyncio.Queue()
+        self._lifespan = asyncio.ensure_future(self.app(
+            {'type': 'lifespan'}, self._inbox.get, self._outbox.put))
+        await self._inbox.put({'type': 'lifespan.startup'})
+        await self._outbox.get()
+
+    async def _stop(self):
+        await self._inbox.put({'type': 'lifespan.shutdown'})
+        await self._outbox.get()
+        await self._lifespan
+
+    def close(self):
+        if self._lifespan is not None:
+            self.loop.run_until_complete(self._stop())
+            self._lifespan = None
+        self.loop.close()
+
+    def open(self, path, method='GET', json=None, data=None, headers=None,
+             content_type=None):
+        path, _, query = path.partition('?')
+        if json is not None:
+            data = dumps(json)
+            content_type = content_type or 'application/json'
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        request_headers = [(b'host', b'localhost')]
+        if content_type:
+            request_headers.append(
+                (b'content-type', content_type.encode('latin-1')))
+        for name, value in (headers or {}).items():
+            request_headers.append(
+                (name.lower().encode('latin-1'), value.encode('latin-1')))
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'root_path': '',
+            'query_string': query.encode('latin-1'),
+            'headers': request_headers, 'server': ('localhost', 80),
+        }
+        return self.loop.run_until_complete(
+            self._request(scope, data or b''))
+
+    async def _request(self, scope, body):
+        messages = [{'type': 'http.request', 'body': body}]
+        response = {'body': []}
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = Headers([
+                    (name.decode('latin-1'), value.decode('latin-1'))
+                    for name, value in message['headers']])
+            else:
+                response['body'].append(message.get('body', b''))
+
+        await self.app(scope, receive, send)
+        return AsgiResponse(response['status'], response['headers'],
+                            b''.join(response['body']))
+
+    def get(self, path, **kwargs):
+        return self.open(path, method='GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, method='POST', **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, method='PUT', **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, method='PATCH', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, method='DELETE', **kwargs)
@@ -0,0 +1,52 @@
+from models import Category, on_change
+from .indexes import ModelIndex
+
+CATEGORY_TTL = 300
+
+'''
+CategoryCache
+    keeps the formatted category list and the id -> type map in process,
+    as a ModelIndex over (id, type)
+'''
+
+
+class CategoryCache(ModelIndex):
+    model = Category
+    columns = ('id', 'type')
+
+    def __init__(self, ttl=CATEGORY_TTL):
+        super(CategoryCache, self).__init__(ttl)
+
+    def clear(self):
+        self._types_by_id = {}
+        self._formatted = []
+
+    def apply(self, action, row):
+        id = row[0]
+        if action == 'delete':
+            self._types_by_id.pop(id, None)
+        else:
+            self._types_by_id[id] = row[1]
+        # FORMATTED IN ID ORDER, REBUILT ON THE NEXT READ
+        self._formatted = None
+
+    def formatted(self):
+        self.warm()
+        with self._lock:
+            if self._formatted is None:
+                self._formatted = [
+                    {'id': id, 'type': self._types_by_id[id]}
+                    for id in sorted(self._types_by_id)]
+            return self._formatted
+
+    def types(self):
+        return [category['type'] for category in self.formatted()]
+
+    def type_of(self, id):
+        self.warm()
+        with self._lock:
+            return self._types_by_id.get(id)
+
+
+category_cache = CategoryCache()
+on_change(category_cache.on_change)
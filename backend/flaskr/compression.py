@@ -0,0 +1,122 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# BODIES SMALLER THAN THIS GO OUT AS THEY ARE, GZIP WOULD ONLY ADD BYTES
+COMPRESS_MIN_SIZE = 500
+# COMPRESSED BODIES KEPT FOR REPEATED GETS OF THE SAME PAGE
+COMPRESS_CACHE_SIZE = 128
+COMPRESS_MIMETYPES = ('application/json', 'text/csv', 'text/html',
+                      'text/plain')
+
+
+def encoded_etag(etag, encoding):
+    '''
+    the strong tag of the encoding's representation of a body tagged etag
+    '''
+    return '{}-{}'.format(etag, encoding)
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    # mtime=0 KEEPS THE BYTES, AND SO THE CACHE, STABLE
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def choose_encoding(accept_encodings):
+    '''
+    br or gzip, whichever the client weighs higher (br on a tie), or None
+    when it accepts neither
+    '''
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(offered)
+
+
+'''
+CompressedCache
+    an LRU of compressed bodies. keys hold the route, the query string,
+    the ETag, which is the dataset version of the conditional views, and
+    the encoding, so a write retires every entry it could have changed.
+'''
+
+
+class CompressedCache(object):
+    def __init__(self, size=COMPRESS_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, body, encoding):
+        with self._lock:
+            compressed = self._bodies.get(key)
+            if compressed is not None:
+                self._bodies.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+        compressed = compress(body, encoding)
+        with self._lock:
+            self._bodies[key] = compressed
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+        return compressed
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self.hits = self.misses = 0
+
+
+compressed_cache = CompressedCache()
+
+'''
+init_compression(app)
+    gzip (or brotli, when installed) for responses the client accepts
+    compressed, above COMPRESS_MIN_SIZE bytes. GETs that carry an ETag
+    reuse their compressed body from compressed_cache, and their tag gets
+    the encoding as a suffix (see encoded_etag), since the compressed
+    bytes are a different representation. streamed responses, 304s and
+    errors are left alone.
+'''
+
+
+def init_compression(app):
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+    min_size = app.config.get('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+    compressed_cache.size = app.config.get(
+        'COMPRESS_CACHE_SIZE', COMPRESS_CACHE_SIZE)
+    compressed_cache.clear()
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.is_streamed or
+                response.direct_passthrough or
+                response.mimetype not in COMPRESS_MIMETYPES or
+                'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None or (response.content_length or 0) < min_size:
+            return response
+        body = response.get_data()
+        etag = response.get_etag()[0]
+        if request.method == 'GET' and etag and compressed_cache.size > 0:
+            key = (request.path, request.query_string, etag, encoding)
+            response.set_data(compressed_cache.get(key, body, encoding))
+        else:
+            response.set_data(compress(body, encoding))
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
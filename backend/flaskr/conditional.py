@@ -0,0 +1,93 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import request, make_response
+
+from models import on_change
+from .compression import encoded_etag
+
+# WRITES MADE BY OTHER WORKERS ARE NOT SEEN BY THIS COUNTER, SO AN ETAG IS
+# ONLY TRUSTED FOR THIS MANY SECONDS
+DATASET_VERSION_TTL = 60
+CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+# SUFFIXES init_compression MAY HAVE PUT ON A TAG
+ETAG_ENCODINGS = ('gzip', 'br')
+
+'''
+DatasetVersion
+    a counter bumped after every committed model write in this process.
+    its etag also covers the process identity and a ttl time bucket, so
+    two workers never produce the same tag for different data and a tag
+    expires even if the write happened in another worker.
+'''
+
+
+class DatasetVersion(object):
+    def __init__(self, ttl=DATASET_VERSION_TTL):
+        self.ttl = ttl
+        self.counter = 0
+        self._lock = threading.Lock()
+        self._boot = uuid.uuid4().hex
+
+    def bump(self):
+        with self._lock:
+            self.counter += 1
+
+    def etag(self):
+        bucket = int(time.time() // self.ttl)
+        key = '{}:{}:{}:{}'.format(
+            self._boot, os.getpid(), self.counter, bucket)
+        return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+dataset_version = DatasetVersion()
+
+
+@on_change
+def bump_dataset_version(model, action):
+    dataset_version.bump()
+
+
+def matching_etag(etag):
+    '''
+    the tag If-None-Match names for the current version: etag or one of
+    its encoded forms, strong or weak. None when the client has none.
+    '''
+    for candidate in (etag,) + tuple(encoded_etag(etag, encoding)
+                                     for encoding in ETAG_ENCODINGS):
+        if request.if_none_match.contains_weak(candidate):
+            return candidate
+    return None
+
+
+'''
+conditional(view)
+    answers If-None-Match with 304 before the view runs, so an unchanged
+    listing costs a header check and no database work. the 304 carries
+    the tag the client matched, encoded or not. successful responses get
+    a strong ETag and a Cache-Control that makes caches revalidate.
+'''
+
+
+def conditional(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # READ THE VERSION BEFORE THE VIEW, A CONCURRENT WRITE THEN ONLY
+        # MAKES THE TAG OLDER THAN THE BODY, NEVER NEWER
+        etag = dataset_version.etag()
+        matched = matching_etag(etag)
+        if matched is not None:
+            response = make_response('', 304)
+            etag = matched
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+    return wrapper
@@ -0,0 +1,64 @@
+import csv
+import io
+
+from models import Question
+from .serialize import QUESTION_FIELDS, dumps, project_questions
+
+# ALIASES ARE EXPORTED SO A DUMP RELOADS WITH THEM, THE API NEVER SENDS THEM
+EXPORT_FIELDS = QUESTION_FIELDS + ('answer_aliases',)
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# ROWS FETCHED PER SERVER-SIDE CURSOR ROUND TRIP AND WRITTEN PER CHUNK
+EXPORT_BATCH = 1000
+
+'''
+export_rows(category, difficulty)
+    streams (id, question, answer, category, difficulty, answer_aliases)
+    tuples in id
+    order. yield_per runs the query on a server-side cursor, so only one
+    batch of rows is held in memory at a time.
+'''
+
+
+def export_rows(category=None, difficulty=None):
+    query = project_questions(Question.query).add_columns(
+        Question.answer_aliases).order_by(Question.id)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query.yield_per(EXPORT_BATCH)
+
+
+def ndjson_chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(dumps(dict(zip(EXPORT_FIELDS, row))))
+        if len(chunk) == EXPORT_BATCH:
+            yield b'\n'.join(chunk) + b'\n'
+            chunk = []
+    if chunk:
+        yield b'\n'.join(chunk) + b'\n'
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_chunks(format, rows):
+    if format == 'csv':
+        return csv_chunks(rows)
+    return ndjson_chunks(rows)
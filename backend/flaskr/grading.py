@@ -0,0 +1,123 @@
+import re
+import unicodedata
+
+from models import Question, db, on_change
+from .indexes import ModelIndex
+
+ANSWER_INDEX_TTL = 60
+# Question.answer_aliases LISTS OTHER ACCEPTED ANSWERS: "1|one"
+ANSWER_ALIAS_SEPARATOR = '|'
+ARTICLES = frozenset(('a', 'an', 'the'))
+NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+'''
+normalize_answer(text)
+    the form answers are compared in: accents and case folded, any run of
+    punctuation or spaces turned into one space, and the articles a, an
+    and the dropped, so "The Liver!" and "liver" are the same answer. an
+    answer made only of articles, such as vitamin "A", keeps them.
+'''
+
+
+def normalize_answer(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = NON_WORD.sub(' ', text.casefold()).split()
+    return ' '.join([word for word in words if word not in ARTICLES] or
+                    words)
+
+
+def parse_aliases(value):
+    '''
+    the answer_aliases column value for a list of aliases or a string of
+    them separated by |, None for no aliases. raises ValueError otherwise.
+    '''
+    if value in (None, '', []):
+        return None
+    if isinstance(value, str):
+        value = value.split(ANSWER_ALIAS_SEPARATOR)
+    if not isinstance(value, list):
+        raise ValueError('answer_aliases must be a list')
+    aliases = [str(alias).strip() for alias in value]
+    return ANSWER_ALIAS_SEPARATOR.join(
+        alias for alias in aliases if alias) or None
+
+
+def answer_entry(answer, aliases=None):
+    '''
+    (answer shown to the player, frozenset of accepted normalized forms)
+    '''
+    accepted = [answer] + (aliases or '').split(ANSWER_ALIAS_SEPARATOR)
+    return answer, frozenset(
+        normalize_answer(text) for text in accepted) - {''}
+
+
+'''
+AnswerIndex
+    question id -> answer_entry(answer, answer_aliases), a ModelIndex over
+    (id, answer, answer_aliases), so grading a whole game reads no rows.
+    ids missing from the index, written by another worker since the last
+    load, are read in one IN query.
+'''
+
+
+class AnswerIndex(ModelIndex):
+    model = Question
+    columns = ('id', 'answer', 'answer_aliases')
+
+    def __init__(self, ttl=ANSWER_INDEX_TTL):
+        super(AnswerIndex, self).__init__(ttl)
+
+    def clear(self):
+        self._entries = {}
+
+    def apply(self, action, row):
+        if action == 'delete':
+            self._entries.pop(row[0], None)
+        else:
+            self._entries[row[0]] = answer_entry(row[1], row[2])
+
+    def entries(self, ids):
+        '''
+        {id: entry} for the ids that exist
+        '''
+        self.warm()
+        with self._lock:
+            found = {id: self._entries[id] for id in ids
+                     if id in self._entries}
+        missing = set(ids) - set(found)
+        if missing:
+            rows = db.session.query(
+                Question.id, Question.answer, Question.answer_aliases).filter(
+                Question.id.in_(missing)).all()
+            for row in rows:
+                found[row[0]] = answer_entry(row[1], row[2])
+                self.change('insert', row)
+        return found
+
+    def grade(self, submissions):
+        '''
+        [(id, submitted answer)] -> [{id, correct, answer}], in order.
+        answer is the one shown to the player, None for an unknown id.
+        '''
+        entries = self.entries(set(id for id, _ in submissions))
+        results = []
+        for id, submitted in submissions:
+            answer, accepted = entries.get(id, (None, frozenset()))
+            results.append({
+                'id': id,
+                'correct': normalize_answer(submitted) in accepted,
+                'answer': answer
+            })
+        return results
+
+
+answer_index = AnswerIndex()
+on_change(answer_index.on_change)
+
+
+def without_answer(question):
+    if question is None:
+        return None
+    return dict((key, value) for key, value in question.items()
+                if key != 'answer')
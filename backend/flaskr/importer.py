@@ -0,0 +1,252 @@
+import csv
+import io
+import json
+import re
+import time
+
+from sqlalchemy import text
+
+from models import db, Question, Category, notify_change
+from .cache import category_cache
+from .grading import parse_aliases
+
+IMPORT_FIELDS = ('question', 'answer', 'category', 'difficulty')
+# MAY BE LEFT OUT OF A ROW
+OPTIONAL_FIELDS = ('answer_aliases',)
+IMPORT_BATCH = 5000
+DIFFICULTIES = range(1, 6)
+# ONLY THE FIRST REJECTED ROWS ARE ECHOED BACK, ALL ARE COUNTED
+MAX_REPORTED_REJECTS = 100
+
+'''
+ImportReport
+    what an import did: rows inserted, rejected rows with the reason, and
+    the duration and throughput of every batch
+'''
+
+
+class ImportReport(object):
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = 0
+        self.rejects = []
+        self.batches = []
+
+    def reject(self, line, error):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({'line': line, 'error': error})
+
+    def add_batch(self, rows, seconds):
+        self.inserted += rows
+        self.batches.append({
+            'rows': rows,
+            'seconds': round(seconds, 4),
+            'rows_per_second': int(rows / seconds) if seconds else rows
+        })
+
+    def format(self):
+        return {
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'rejects': self.rejects,
+            'batches': self.batches
+        }
+
+
+def parse_ndjson(lines):
+    # LINES ARE DECODED ONE BY ONE IN import_questions, SO A MALFORMED LINE
+    # IS REJECTED ON ITS OWN
+    for line in lines:
+        if line.strip():
+            yield line
+
+
+def parse_csv(lines):
+    return csv.DictReader(lines)
+
+
+def parse_rows(format, lines):
+    if format == 'csv':
+        return parse_csv(lines)
+    return parse_ndjson(lines)
+
+
+'''
+validate_row(row)
+    returns the insert mapping for one parsed row, or raises ValueError
+    with the reason it was rejected. an explicit id is kept, so dumps can
+    be reloaded with their original ids.
+'''
+
+
+def validate_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('row is not an object')
+    for field in IMPORT_FIELDS:
+        if row.get(field) in (None, ''):
+            raise ValueError('missing {}'.format(field))
+    mapping = {
+        'question': str(row['question']),
+        'answer': str(row['answer']),
+        'category': int(row['category']),
+        'difficulty': int(row['difficulty']),
+        'answer_aliases': parse_aliases(row.get('answer_aliases'))
+    }
+    if category_cache.type_of(mapping['category']) is None:
+        raise ValueError('unknown category {}'.format(mapping['category']))
+    if mapping['difficulty'] not in DIFFICULTIES:
+        raise ValueError('difficulty must be 1 to 5')
+    if row.get('id') not in (None, ''):
+        mapping['id'] = int(row['id'])
+    return mapping
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def copy_batch(table, columns, batch):
+    # COPY ... FROM STDIN THROUGH THE RAW PSYCOPG2 CONNECTION
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for mapping in batch:
+        writer.writerow([mapping[column] for column in columns])
+    buffer.seek(0)
+    connection = db.session.connection().connection
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(
+            table, ', '.join(columns)), buffer)
+
+
+def insert_batch(model, columns, batch):
+    if is_postgres():
+        copy_batch(model.__tablename__, columns, batch)
+    else:
+        db.session.bulk_insert_mappings(model, batch)
+
+
+def reset_id_sequence(table):
+    if is_postgres():
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "(SELECT MAX(id) FROM {0}))".format(table)))
+
+
+def write_batch(batch, report):
+    started = time.perf_counter()
+    with_id = [mapping for mapping in batch if 'id' in mapping]
+    without_id = [mapping for mapping in batch if 'id' not in mapping]
+    if with_id:
+        insert_batch(Question, ('id',) + IMPORT_FIELDS + OPTIONAL_FIELDS,
+                     with_id)
+        reset_id_sequence(Question.__tablename__)
+    if without_id:
+        insert_batch(Question, IMPORT_FIELDS + OPTIONAL_FIELDS, without_id)
+    db.session.commit()
+    report.add_batch(len(batch), time.perf_counter() - started)
+
+
+'''
+import_questions(rows)
+    validates parsed rows (NDJSON lines are decoded here, one at a time)
+    and writes them batch_size at a time, one
+    transaction per batch, with COPY on Postgres and bulk_insert_mappings
+    elsewhere. a batch that fails is rolled back and its rows rejected.
+'''
+
+
+def import_questions(rows, batch_size=IMPORT_BATCH, on_batch=None):
+    report = ImportReport()
+    batch = []
+    # SOURCE LINE OF EVERY MAPPING IN batch
+    batch_lines = []
+
+    def flush():
+        try:
+            write_batch(batch, report)
+        except Exception as error:
+            db.session.rollback()
+            for batch_line in batch_lines:
+                report.reject(batch_line, 'batch failed: {}'.format(error))
+        if on_batch is not None and report.batches:
+            on_batch(report.batches[-1])
+        del batch[:]
+        del batch_lines[:]
+
+    line = 0
+    try:
+        for line, row in enumerate(rows, start=1):
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                batch.append(validate_row(row))
+                batch_lines.append(line)
+            except (TypeError, ValueError) as error:
+                report.reject(line, str(error))
+                continue
+            if len(batch) == batch_size:
+                flush()
+    except ValueError as error:
+        # THE STREAM ITSELF IS MALFORMED, STOP AT THE BAD LINE
+        report.reject(line + 1, str(error))
+    if batch:
+        flush()
+
+    if report.inserted:
+        notify_change(Question, 'bulk')
+    return report
+
+
+'''
+psql seed dumps
+    read_psql_copy(lines) yields (table, columns, rows) for every
+    COPY ... FROM stdin block of a pg_dump file such as trivia.psql, so
+    the seed data can be loaded without psql
+'''
+
+COPY_HEADER = re.compile(r'^COPY (?:\w+\.)?(\w+) \(([^)]*)\) FROM stdin;$')
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+
+def unescape_copy_value(value):
+    if value == '\\N':
+        return None
+    return re.sub(r'\\(.)', lambda match: COPY_ESCAPES.get(
+        match.group(1), match.group(1)), value)
+
+
+def read_psql_copy(lines):
+    table = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if table is None:
+            match = COPY_HEADER.match(line)
+            if match:
+                table = match.group(1)
+                columns = [column.strip()
+                           for column in match.group(2).split(',')]
+                rows = []
+        elif line == '\\.':
+            yield table, columns, rows
+            table = None
+        else:
+            rows.append(dict(zip(columns, [
+                unescape_copy_value(value) for value in line.split('\t')])))
+
+
+def load_psql_seed(lines, batch_size=IMPORT_BATCH, on_batch=None):
+    '''
+    loads the categories of a seed dump first, then imports its questions
+    '''
+    report = ImportReport()
+    for table, columns, rows in read_psql_copy(lines):
+        if table == Category.__tablename__:
+            db.session.bulk_insert_mappings(Category, [
+                {'id': int(row['id']), 'type': row['type']} for row in rows])
+            reset_id_sequence(Category.__tablename__)
+            db.session.commit()
+            notify_change(Category, 'bulk')
+        elif table == Question.__tablename__:
+            report = import_questions(rows, batch_size, on_batch)
+    return report
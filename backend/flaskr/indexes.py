@@ -0,0 +1,83 @@
+import threading
+import time
+
+from models import db
+
+'''
+ModelIndex
+    rows of one model held in process, loaded with a single query over
+    columns. it follows the writes this process commits (on_change) and
+    is reloaded once older than ttl seconds, to pick up writes made by
+    other workers. every reset or write bumps version, so callers can
+    tell two states apart.
+
+    a subclass names its model and columns and implements clear(), which
+    empties its state, and apply(action, row), which folds one
+    'insert', 'update' or 'delete' of a (column, ...) row into it; a load
+    is clear() then an insert per row. both run under the lock, and so
+    must any read of state apply() changes.
+'''
+
+
+class ModelIndex(object):
+    model = None
+    columns = ()
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.clear()
+
+    def clear(self):
+        raise NotImplementedError
+
+    def apply(self, action, row):
+        raise NotImplementedError
+
+    def load_rows(self):
+        return db.session.query(*[getattr(self.model, column)
+                                  for column in self.columns]).all()
+
+    def fresh(self):
+        return (self._loaded_at is not None and
+                time.monotonic() - self._loaded_at < self.ttl)
+
+    def _load(self):
+        with self._lock:
+            if self.fresh():
+                return
+            self.clear()
+            for row in self.load_rows():
+                self.apply('insert', row)
+            self._loaded_at = time.monotonic()
+
+    def warm(self):
+        if not self.fresh():
+            self._load()
+
+    def change(self, action, row):
+        # BEFORE THE FIRST LOAD THERE IS NOTHING TO UPDATE, THE LOAD READS IT
+        with self._lock:
+            self.version += 1
+            if self._loaded_at is not None:
+                self.apply(action, row)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self.version += 1
+            self.clear()
+
+    def on_change(self, model, action):
+        '''
+        the change listener: a bulk write to the model resets the index,
+        a single row write is applied to it
+        '''
+        if action == 'bulk':
+            if model is self.model:
+                self.invalidate()
+        elif isinstance(model, self.model):
+            self.change(action, tuple(getattr(model, column)
+                                      for column in self.columns))
@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# STATEMENTS KEPT PER REQUEST FOR THE SLOW REQUEST LOG
+MAX_LOGGED_STATEMENTS = 50
+
+logger = logging.getLogger(__name__)
+
+'''
+Histogram
+    a Prometheus histogram per endpoint label: cumulative bucket counts,
+    a sum and a count
+'''
+
+
+class Histogram(object):
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for endpoint, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(
+                        '{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                            self.name, endpoint, bound, count))
+                lines.append('{}_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+                    self.name, endpoint, series['count']))
+                lines.append('{}_sum{{endpoint="{}"}} {}'.format(
+                    self.name, endpoint, series['sum']))
+                lines.append('{}_count{{endpoint="{}"}} {}'.format(
+                    self.name, endpoint, series['count']))
+        return lines
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append('{}{{{}}} {}'.format(
+                    self.name, ','.join('{}="{}"'.format(key, label)
+                                        for key, label in labels), value))
+        return lines
+
+
+class Gauge(Counter):
+    '''
+    a Counter that may also go down: inc with a negative amount
+    '''
+    kind = 'gauge'
+
+
+'''
+MetricsRegistry
+    the aggregated metrics of this process, rendered at /metrics
+'''
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.requests = Counter(
+            'trivia_requests_total', 'Requests by endpoint and status.')
+        self.latency = Histogram(
+            'trivia_request_duration_seconds',
+            'Total request latency.', SECONDS_BUCKETS)
+        self.sql_time = Histogram(
+            'trivia_sql_duration_seconds',
+            'Time spent in SQL per request.', SECONDS_BUCKETS)
+        self.sql_queries = Histogram(
+            'trivia_sql_queries',
+            'SQL statements per request.', QUERY_BUCKETS)
+        self.serialize_time = Histogram(
+            'trivia_serialize_duration_seconds',
+            'Time spent encoding JSON per request.', SECONDS_BUCKETS)
+        self.collectors = [self.requests, self.latency, self.sql_time,
+                           self.sql_queries, self.serialize_time]
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+'''
+RequestTimings
+    what the current request has spent so far, kept on flask.g
+'''
+
+
+class RequestTimings(object):
+    def __init__(self, keep_statements):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.serialize = 0.0
+        self.statements = [] if keep_statements else None
+
+
+def current_timings():
+    if has_app_context():
+        return g.get('timings')
+    return None
+
+
+@contextmanager
+def timed_serialization():
+    started = time.perf_counter()
+    yield
+    timings = current_timings()
+    if timings is not None:
+        timings.serialize += time.perf_counter() - started
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    timings = current_timings()
+    if timings is None:
+        return
+    timings.queries += 1
+    timings.sql += elapsed
+    if timings.statements is not None and \
+            len(timings.statements) < MAX_LOGGED_STATEMENTS:
+        timings.statements.append((round(elapsed * 1000, 3), statement))
+
+
+def server_timing(timings, total):
+    app_time = max(total - timings.sql - timings.serialize, 0)
+    return ', '.join([
+        'db;dur={:.3f};desc="{} queries"'.format(
+            timings.sql * 1000, timings.queries),
+        'serialize;dur={:.3f}'.format(timings.serialize * 1000),
+        'app;dur={:.3f}'.format(app_time * 1000),
+        'total;dur={:.3f}'.format(total * 1000),
+    ])
+
+
+'''
+init_metrics(app)
+    times every request, adds a Server-Timing header and records the
+    aggregates. SLOW_REQUEST_MS > 0 logs slower requests together with
+    their SQL. METRICS_ENABLED = False turns all of it off.
+'''
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    slow_request_ms = app.config.get('SLOW_REQUEST_MS', 0)
+
+    @app.before_request
+    def start_request_timer():
+        g.timings = RequestTimings(keep_statements=slow_request_ms > 0)
+
+    @app.after_request
+    def record_request(response):
+        timings = g.pop('timings', None)
+        if timings is None:
+            return response
+        total = time.perf_counter() - timings.started
+        endpoint = request.endpoint or 'unmatched'
+        metrics_registry.requests.inc(
+            (('endpoint', endpoint), ('status', str(response.status_code))))
+        metrics_registry.latency.observe(endpoint, total)
+        metrics_registry.sql_time.observe(endpoint, timings.sql)
+        metrics_registry.sql_queries.observe(endpoint, timings.queries)
+        metrics_registry.serialize_time.observe(endpoint, timings.serialize)
+        response.headers['Server-Timing'] = server_timing(timings, total)
+        if slow_request_ms and total * 1000 >= slow_request_ms:
+            logger.warning(
+                'slow request %s %s: %.1fms, %d queries in %.1fms\n%s',
+                request.method, request.full_path, total * 1000,
+                timings.queries, timings.sql * 1000,
+                '\n'.join('  {}ms {}'.format(duration, statement)
+                          for duration, statement in timings.statements))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(metrics_registry.render(),
+                        mimetype='text/plain; version=0.0.4')
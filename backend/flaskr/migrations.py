@@ -0,0 +1,397 @@
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Column, Integer, MetaData, String, Table, text
+
+from models import db
+
+'''
+schema migrations
+    an ordered list of versioned upgrade steps, recorded in the
+    schema_migrations table once applied. `flask db upgrade` applies the
+    pending ones. on Postgres, indexes are built CONCURRENTLY and foreign
+    keys are added NOT VALID and then validated, so a live deployment
+    keeps serving reads and writes while it migrates.
+'''
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+
+class Migration(object):
+    def __init__(self, version, description, upgrade, downgrade=None,
+                 transactional=True):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.downgrade = downgrade
+        # CREATE INDEX CONCURRENTLY CANNOT RUN INSIDE A TRANSACTION
+        self.transactional = transactional
+
+
+def is_postgres(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def drop_invalid_index(connection, name):
+    # A FAILED CONCURRENT BUILD LEAVES AN INVALID INDEX BEHIND
+    invalid = connection.execute(text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = "
+        "pg_index.indexrelid WHERE pg_class.relname = :name "
+        "AND NOT pg_index.indisvalid"), name=name).first()
+    if invalid:
+        connection.execute(text(
+            'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name)))
+
+
+def create_index(connection, name, table, columns, using=None):
+    if is_postgres(connection):
+        drop_invalid_index(connection, name)
+        connection.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}({})'.format(
+                name, table, 'USING {} '.format(using) if using else '',
+                columns)))
+    elif using is None:
+        connection.execute(text('CREATE INDEX IF NOT EXISTS {} ON {} ({})'
+                                .format(name, table, columns)))
+
+
+def drop_index(connection, name):
+    if is_postgres(connection):
+        connection.execute(text(
+            'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name)))
+    else:
+        connection.execute(text('DROP INDEX IF EXISTS {}'.format(name)))
+
+
+'''
+baseline schema
+    the tables as 0001 first created them. never edit these: later
+    migrations add to them, and a fresh database has to go through the
+    same steps as a deployed one.
+'''
+BASELINE = MetaData()
+Table('categories', BASELINE,
+      Column('id', Integer, primary_key=True),
+      Column('type', String))
+Table('questions', BASELINE,
+      Column('id', Integer, primary_key=True),
+      Column('question', String),
+      Column('answer', String),
+      Column('category', Integer),
+      Column('difficulty', Integer))
+
+
+def create_tables(connection):
+    BASELINE.create_all(connection, checkfirst=True)
+
+
+def add_category_index(connection):
+    # SERVES filter_by(category=...) ORDERED BY id, AND KEYSET PAGES
+    create_index(connection, 'questions_category_id_idx', 'questions',
+                 'category, id')
+
+
+def drop_category_index(connection):
+    drop_index(connection, 'questions_category_id_idx')
+
+
+def add_difficulty_index(connection):
+    create_index(connection, 'questions_difficulty_idx', 'questions',
+                 'difficulty')
+
+
+def drop_difficulty_index(connection):
+    drop_index(connection, 'questions_difficulty_idx')
+
+
+def rebuild_sqlite_questions(connection):
+    # SQLITE CANNOT ADD A CONSTRAINT TO AN EXISTING TABLE: COPY THE ROWS
+    # INTO A NEW TABLE THAT HAS IT, THEN PUT THE INDEXES BACK
+    keys = connection.execute(text(
+        'PRAGMA foreign_key_list(questions)')).fetchall()
+    if keys:
+        return
+    connection.execute(text(
+        'CREATE TABLE questions_rebuilt (id INTEGER NOT NULL PRIMARY KEY, '
+        'question VARCHAR, answer VARCHAR, category INTEGER, '
+        'difficulty INTEGER, CONSTRAINT questions_category_fkey '
+        'FOREIGN KEY (category) REFERENCES categories (id) '
+        'ON UPDATE CASCADE ON DELETE SET NULL)'))
+    connection.execute(text(
+        'INSERT INTO questions_rebuilt (id, question, answer, category, '
+        'difficulty) SELECT id, question, answer, category, difficulty '
+        'FROM questions'))
+    connection.execute(text('DROP TABLE questions'))
+    connection.execute(text(
+        'ALTER TABLE questions_rebuilt RENAME TO questions'))
+    add_category_index(connection)
+    add_difficulty_index(connection)
+
+
+def add_category_foreign_key(connection):
+    if not is_postgres(connection):
+        rebuild_sqlite_questions(connection)
+        return
+    existing = connection.execute(text(
+        "SELECT 1 FROM pg_constraint WHERE contype = 'f' "
+        "AND conrelid = 'questions'::regclass "
+        "AND confrelid = 'categories'::regclass")).first()
+    if existing:
+        return
+    connection.execute(text(
+        'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey '
+        'FOREIGN KEY (category) REFERENCES categories (id) '
+        'ON UPDATE CASCADE ON DELETE SET NULL NOT VALID'))
+    connection.execute(text(
+        'ALTER TABLE questions VALIDATE CONSTRAINT questions_category_fkey'))
+
+
+def drop_category_foreign_key(connection):
+    if is_postgres(connection):
+        connection.execute(text(
+            'ALTER TABLE questions '
+            'DROP CONSTRAINT IF EXISTS questions_category_fkey'))
+
+
+def add_search_indexes(connection):
+    # ONLY POSTGRES SEARCHES IN THE DATABASE, ELSEWHERE THE INVERTED INDEX
+    # IN flaskr/search.py IS USED
+    if not is_postgres(connection):
+        return
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    create_index(connection, 'questions_question_trgm_idx', 'questions',
+                 'question gin_trgm_ops', using='gin')
+    create_index(connection, 'questions_question_fts_idx', 'questions',
+                 "to_tsvector('english', coalesce(question, ''))",
+                 using='gin')
+
+
+def drop_search_indexes(connection):
+    drop_index(connection, 'questions_question_trgm_idx')
+    drop_index(connection, 'questions_question_fts_idx')
+
+
+# questions.category AND difficulty ARE NULLABLE, COUNTED UNDER -1
+SQLITE_COUNT_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS questions_count_insert '
+    'AFTER INSERT ON questions BEGIN {insert} END',
+    'CREATE TRIGGER IF NOT EXISTS questions_count_delete '
+    'AFTER DELETE ON questions BEGIN {delete} END',
+    'CREATE TRIGGER IF NOT EXISTS questions_count_update '
+    'AFTER UPDATE OF category, difficulty ON questions '
+    'BEGIN {delete} {insert} END',
+)
+SQLITE_COUNT_INSERT = (
+    'INSERT OR IGNORE INTO question_counts VALUES '
+    '(coalesce(NEW.category, -1), coalesce(NEW.difficulty, -1), 0); '
+    'UPDATE question_counts SET total = total + 1 '
+    'WHERE category = coalesce(NEW.category, -1) '
+    'AND difficulty = coalesce(NEW.difficulty, -1);')
+SQLITE_COUNT_DELETE = (
+    'UPDATE question_counts SET total = total - 1 '
+    'WHERE category = coalesce(OLD.category, -1) '
+    'AND difficulty = coalesce(OLD.difficulty, -1);')
+POSTGRES_COUNT_FUNCTION = '''
+CREATE OR REPLACE FUNCTION count_questions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE question_counts SET total = total - 1
+        WHERE category = coalesce(OLD.category, -1)
+        AND difficulty = coalesce(OLD.difficulty, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO question_counts VALUES
+        (coalesce(NEW.category, -1), coalesce(NEW.difficulty, -1), 1)
+        ON CONFLICT (category, difficulty)
+        DO UPDATE SET total = question_counts.total + 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql'''
+
+
+def add_question_counts(connection):
+    # THE TRIGGERS WRITE THE COUNTS IN THE TRANSACTION THAT CHANGED THE
+    # ROWS, WHOEVER WROTE THEM: ANY WORKER, A BULK IMPORT OR RAW SQL
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS question_counts ('
+        'category INTEGER NOT NULL, difficulty INTEGER NOT NULL, '
+        'total INTEGER NOT NULL, PRIMARY KEY (category, difficulty))'))
+    if is_postgres(connection):
+        connection.execute(text(POSTGRES_COUNT_FUNCTION))
+        connection.execute(text(
+            'DROP TRIGGER IF EXISTS questions_count ON questions'))
+        connection.execute(text(
+            'CREATE TRIGGER questions_count AFTER INSERT OR DELETE OR '
+            'UPDATE OF category, difficulty ON questions FOR EACH ROW '
+            'EXECUTE PROCEDURE count_questions()'))
+    else:
+        for trigger in SQLITE_COUNT_TRIGGERS:
+            connection.execute(text(trigger.format(
+                insert=SQLITE_COUNT_INSERT, delete=SQLITE_COUNT_DELETE)))
+    # THE TRIGGER HOLDS WRITERS OFF UNTIL COMMIT, SO NOTHING IS MISSED
+    connection.execute(text('DELETE FROM question_counts'))
+    connection.execute(text(
+        'INSERT INTO question_counts (category, difficulty, total) '
+        'SELECT coalesce(category, -1), coalesce(difficulty, -1), count(*) '
+        'FROM questions GROUP BY coalesce(category, -1), '
+        'coalesce(difficulty, -1)'))
+
+
+def drop_question_counts(connection):
+    if is_postgres(connection):
+        connection.execute(text(
+            'DROP TRIGGER IF EXISTS questions_count ON questions'))
+        connection.execute(text('DROP FUNCTION IF EXISTS count_questions()'))
+    else:
+        for name in ('insert', 'delete', 'update'):
+            connection.execute(text(
+                'DROP TRIGGER IF EXISTS questions_count_{}'.format(name)))
+    connection.execute(text('DROP TABLE IF EXISTS question_counts'))
+
+
+def add_answer_aliases(connection):
+    # OTHER ACCEPTED ANSWERS FOR GRADING, answer STAYS THE ONE SHOWN
+    connection.execute(text(
+        'ALTER TABLE questions ADD COLUMN answer_aliases VARCHAR'))
+
+
+def drop_answer_aliases(connection):
+    connection.execute(text(
+        'ALTER TABLE questions DROP COLUMN answer_aliases'))
+
+
+MIGRATIONS = [
+    Migration('0001', 'create questions and categories', create_tables),
+    Migration('0002', 'index questions (category, id)', add_category_index,
+              drop_category_index, transactional=False),
+    Migration('0003', 'index questions (difficulty)', add_difficulty_index,
+              drop_difficulty_index, transactional=False),
+    Migration('0004', 'questions.category foreign key',
+              add_category_foreign_key, drop_category_foreign_key),
+    Migration('0005', 'question search indexes', add_search_indexes,
+              drop_search_indexes, transactional=False),
+    Migration('0006', 'question counts kept by triggers',
+              add_question_counts, drop_question_counts),
+    Migration('0007', 'questions.answer_aliases', add_answer_aliases,
+              drop_answer_aliases),
+]
+
+
+def ensure_migrations_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS {} (version VARCHAR(32) PRIMARY KEY, '
+            'description VARCHAR(255), applied_at FLOAT)'
+            .format(MIGRATIONS_TABLE)))
+
+
+def applied_versions(engine):
+    ensure_migrations_table(engine)
+    with engine.connect() as connection:
+        return set(row[0] for row in connection.execute(text(
+            'SELECT version FROM {}'.format(MIGRATIONS_TABLE))))
+
+
+def run_step(engine, migration, step):
+    if migration.transactional:
+        with engine.begin() as connection:
+            step(connection)
+    else:
+        with engine.connect() as connection:
+            step(connection.execution_options(isolation_level='AUTOCOMMIT'))
+
+
+def upgrade(engine, target=None, echo=None):
+    '''
+    applies every pending migration up to target (default: the latest)
+    and returns the versions that were applied
+    '''
+    done = applied_versions(engine)
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        if migration.version in done:
+            continue
+        if echo:
+            echo('applying {} {}'.format(
+                migration.version, migration.description))
+        run_step(engine, migration, migration.upgrade)
+        with engine.begin() as connection:
+            connection.execute(text(
+                'INSERT INTO {} (version, description, applied_at) '
+                'VALUES (:version, :description, :applied_at)'
+                .format(MIGRATIONS_TABLE)),
+                version=migration.version,
+                description=migration.description,
+                applied_at=time.time())
+        applied.append(migration.version)
+    return applied
+
+
+def downgrade(engine, target, echo=None):
+    '''
+    reverts applied migrations newer than target
+    '''
+    done = applied_versions(engine)
+    reverted = []
+    for migration in reversed(MIGRATIONS):
+        if migration.version <= target or migration.version not in done:
+            continue
+        if migration.downgrade is None:
+            raise RuntimeError('{} cannot be reverted'.format(
+                migration.version))
+        if echo:
+            echo('reverting {} {}'.format(
+                migration.version, migration.description))
+        run_step(engine, migration, migration.downgrade)
+        with engine.begin() as connection:
+            connection.execute(text(
+                'DELETE FROM {} WHERE version = :version'
+                .format(MIGRATIONS_TABLE)), version=migration.version)
+        reverted.append(migration.version)
+    return reverted
+
+
+def current_version(engine):
+    done = applied_versions(engine)
+    return max(done) if done else None
+
+
+db_cli = AppGroup('db', help='Manage the database schema.')
+
+
+@db_cli.command('upgrade')
+@click.option('--target', default=None, help='Stop at this version.')
+def upgrade_command(target):
+    """Apply pending migrations."""
+    applied = upgrade(db.engine, target, echo=click.echo)
+    click.echo('applied {} migration(s), now at {}'.format(
+        len(applied), current_version(db.engine)))
+
+
+@db_cli.command('downgrade')
+@click.argument('target')
+def downgrade_command(target):
+    """Revert migrations newer than TARGET."""
+    reverted = downgrade(db.engine, target, echo=click.echo)
+    click.echo('reverted {} migration(s), now at {}'.format(
+        len(reverted), current_version(db.engine)))
+
+
+@db_cli.command('current')
+def current_command():
+    """Show the applied schema version."""
+    click.echo(current_version(db.engine) or 'none')
+
+
+@db_cli.command('history')
+def history_command():
+    """List migrations and whether they are applied."""
+    done = applied_versions(db.engine)
+    for migration in MIGRATIONS:
+        click.echo('{} {} {}'.format(
+            '*' if migration.version in done else ' ',
+            migration.version, migration.description))
@@ -0,0 +1,98 @@
+from bisect import bisect_right
+
+from models import Question
+from .serialize import format_row, project_questions
+
+QUESTIONS_PER_PAGE = 10
+
+'''
+Page
+    one page of formatted questions plus the total row count of the
+    underlying query and the cursor for the next keyset page
+'''
+
+
+class Page(object):
+    def __init__(self, questions, total, next_after_id=None):
+        self.questions = questions
+        self.total = total
+        self.next_after_id = next_after_id
+
+    def current_category(self):
+        return [question['category'] for question in self.questions]
+
+
+def page_number(request):
+    return request.args.get('page', 1, type=int)
+
+
+'''
+paginate_questions(request, query)
+    runs LIMIT/OFFSET for ?page=N, or a keyset seek for ?after_id=N, so only
+    one page of rows is ever loaded. callers that already know the total
+    (see flaskr/stats.py) pass it, otherwise it comes from a COUNT on the
+    same filtered query without its ORDER BY. a query with its own ranking
+    passes order_by and is always paged by offset.
+'''
+
+
+def paginate_questions(request, query, per_page=QUESTIONS_PER_PAGE,
+                       order_by=None, total=None):
+    after_id = request.args.get('after_id', None, type=int)
+    if order_by is not None:
+        page = page_number(request)
+        rows = []
+        if page >= 1:
+            rows = project_questions(query).order_by(*order_by).limit(
+                per_page).offset((page - 1) * per_page).all()
+    elif after_id is not None:
+        # KEYSET MODE: SEEK PAST THE LAST ID THE CLIENT HAS SEEN
+        rows = project_questions(query).filter(
+            Question.id > after_id).order_by(
+            Question.id).limit(per_page).all()
+    else:
+        page = page_number(request)
+        if page < 1:
+            rows = []
+        else:
+            rows = project_questions(query).order_by(Question.id).limit(
+                per_page).offset((page - 1) * per_page).all()
+
+    questions = [format_row(row) for row in rows]
+    if total is None:
+        total = query.order_by(None).count()
+
+    next_after_id = None
+    if order_by is None and len(questions) == per_page:
+        next_after_id = questions[-1]['id']
+
+    return Page(questions, total, next_after_id)
+
+
+'''
+paginate_ids(request, ids)
+    pages through a list of matching question ids computed in process
+    (already sorted by id, or by rank when ranked is set) and loads only
+    the rows of the requested page
+'''
+
+
+def paginate_ids(request, ids, per_page=QUESTIONS_PER_PAGE, ranked=False):
+    after_id = request.args.get('after_id', None, type=int)
+    if after_id is not None and not ranked:
+        start = bisect_right(ids, after_id)
+    else:
+        start = (page_number(request) - 1) * per_page
+    page_ids = ids[start:start + per_page] if start >= 0 else []
+
+    rows = {}
+    if page_ids:
+        rows = {row[0]: row for row in project_questions(Question.query)
+                .filter(Question.id.in_(page_ids)).all()}
+    questions = [format_row(rows[id]) for id in page_ids if id in rows]
+
+    next_after_id = None
+    if not ranked and len(questions) == per_page:
+        next_after_id = questions[-1]['id']
+
+    return Page(questions, len(ids), next_after_id)
@@ -0,0 +1,34 @@
+import gc
+
+from models import db, is_sqlite_memory
+from .cache import category_cache
+from .grading import answer_index
+from .quiz import ALL_CATEGORIES, quiz_sampler
+from .search import question_search
+
+'''
+warm_caches(app)
+    builds the in-process caches (categories, quiz pools, the search
+    index and the answer index) before a preloading WSGI server forks,
+    e.g.
+
+        PRELOAD_CACHES=1 gunicorn --preload -w 4 'flaskr:create_app()'
+
+    then closes the pooled connections so no worker inherits a socket
+    from the master (except for an in-memory database, whose only
+    connection is the database), and freezes the heap so the collector does not
+    write to the shared pages. workers start with the caches warm and
+    share them copy-on-write until their ttl runs out.
+'''
+
+
+def warm_caches(app):
+    with app.app_context():
+        category_cache.formatted()
+        quiz_sampler.pool(ALL_CATEGORIES)
+        question_search.warm()
+        answer_index.warm()
+        db.session.remove()
+        if not is_sqlite_memory(app.config['SQLALCHEMY_DATABASE_URI']):
+            db.get_engine(app).dispose()
+    gc.freeze()
@@ -0,0 +1,295 @@
+import random
+
+from models import Question, on_change
+from .indexes import ModelIndex
+from .serialize import format_row, project_questions
+
+ALL_CATEGORIES = 0
+QUIZ_POOL_TTL = 60
+# MOST QUESTIONS ONE /quizzes CALL RETURNS, ALSO THE SIZE OF A GAME PLAN
+QUIZ_MAX_COUNT = 50
+# QUESTIONS PLAYED AT EACH DIFFICULTY OF A RAMP, UNLESS THE CLIENT SAYS
+QUIZ_RAMP_STEP = 3
+
+'''
+QuestionPool
+    an array of question ids plus an id -> position map, so ids can be
+    added, removed and drawn uniformly in O(1)
+'''
+
+
+class QuestionPool(object):
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def add(self, id):
+        if id not in self.positions:
+            self.positions[id] = len(self.ids)
+            self.ids.append(id)
+
+    def remove(self, id):
+        position = self.positions.pop(id, None)
+        if position is None:
+            return
+        # SWAP THE LAST ID INTO THE FREED SLOT
+        last = self.ids.pop()
+        if last != id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def draw(self, excluded=()):
+        '''
+        returns a random id that is not in excluded, or None when every
+        id in the pool has been excluded. the first pick is O(1); only a
+        pick that lands on an excluded id pays O(len(excluded)) to remap
+        it, like a Fisher-Yates shuffle that moved the excluded ids to
+        the end of the array.
+        '''
+        excluded = set(id for id in excluded if id in self.positions)
+        size = len(self.ids) - len(excluded)
+        if size <= 0:
+            return None
+        pick = random.randrange(size)
+        if self.ids[pick] not in excluded:
+            return self.ids[pick]
+        holes = sorted(self.positions[id] for id in excluded
+                       if self.positions[id] < size)
+        fillers = [id for id in self.ids[size:] if id not in excluded]
+        return fillers[holes.index(pick)]
+
+    def available(self, excluded=()):
+        return len(self.ids) - sum(1 for id in excluded
+                                   if id in self.positions)
+
+    def sample(self, count, excluded=()):
+        '''
+        up to count distinct ids not in excluded, in random order
+        '''
+        excluded = set(excluded)
+        picked = []
+        while len(picked) < count:
+            id = self.draw(excluded)
+            if id is None:
+                break
+            picked.append(id)
+            excluded.add(id)
+        return picked
+
+
+'''
+DifficultyFilter
+    the difficulties a quiz draws from: low..high (None leaves an end
+    open), and with a ramp, a target that starts at low and climbs one
+    level every step questions played. a ramp draws at the target, or at
+    the nearest difficulty in range that has questions left.
+'''
+
+
+class DifficultyFilter(object):
+    def __init__(self, low=None, high=None, ramp=None):
+        if low is not None and high is not None and low > high:
+            raise ValueError('difficulty min is above max')
+        if ramp is not None and ramp < 1:
+            raise ValueError('ramp step must be positive')
+        self.low = low
+        self.high = high
+        self.ramp = ramp
+
+    def allows(self, difficulty):
+        if difficulty is None:
+            return False
+        return ((self.low is None or difficulty >= self.low) and
+                (self.high is None or difficulty <= self.high))
+
+    def levels(self, difficulties, played):
+        '''
+        the allowed difficulties as groups to try in order: one group for
+        a range, one group per difficulty, nearest to the target first,
+        for a ramp
+        '''
+        allowed = sorted(d for d in difficulties if self.allows(d))
+        if self.ramp is None or not allowed:
+            return [allowed]
+        target = (allowed[0] if self.low is None else self.low) + \
+            played // self.ramp
+        if self.high is not None:
+            target = min(target, self.high)
+        return [[d] for d in sorted(
+            allowed, key=lambda d: (abs(d - target), d))]
+
+
+def parse_difficulty(body):
+    '''
+    a DifficultyFilter from the difficulty and ramp fields of a /quizzes
+    body, or None when it has neither. difficulty is a number or
+    {"min": 2, "max": 4}; ramp is true or the questions played per level.
+    raises ValueError on anything else.
+    '''
+    difficulty = body.get('difficulty')
+    ramp = body.get('ramp')
+    if difficulty is None and not ramp:
+        return None
+    if isinstance(difficulty, dict):
+        low, high = difficulty.get('min'), difficulty.get('max')
+    else:
+        low = high = difficulty
+    low = None if low is None else int(low)
+    high = None if high is None else int(high)
+    if ramp is True:
+        ramp = QUIZ_RAMP_STEP
+    elif ramp:
+        ramp = int(ramp)
+    else:
+        ramp = None
+    return DifficultyFilter(low, high, ramp)
+
+
+def draw_from(pools, excluded):
+    '''
+    a uniform draw over the union of disjoint pools: pick a pool by the
+    number of ids it has left, then draw inside it
+    '''
+    sizes = [pool.available(excluded) for pool in pools]
+    total = sum(sizes)
+    if total <= 0:
+        return None
+    pick = random.randrange(total)
+    for pool, size in zip(pools, sizes):
+        if pick < size:
+            return pool.draw(excluded)
+        pick -= size
+
+
+'''
+QuizSampler
+    keeps one QuestionPool per category plus one for all categories, and
+    the same split again by difficulty, so a filtered draw only touches
+    the pools of the difficulties it allows. a ModelIndex over
+    (id, category, difficulty).
+'''
+
+
+class QuizSampler(ModelIndex):
+    model = Question
+    columns = ('id', 'category', 'difficulty')
+
+    def __init__(self, ttl=QUIZ_POOL_TTL):
+        super(QuizSampler, self).__init__(ttl)
+
+    def clear(self):
+        self._pools = {ALL_CATEGORIES: QuestionPool()}
+        # CATEGORY -> {DIFFICULTY: QuestionPool}
+        self._levels = {ALL_CATEGORIES: {}}
+
+    def apply(self, action, row):
+        id = row[0]
+        if action != 'insert':
+            for pool in self._pools.values():
+                pool.remove(id)
+            for levels in self._levels.values():
+                for pool in levels.values():
+                    pool.remove(id)
+        if action == 'delete':
+            return
+        id, category, difficulty = row
+        for key in (ALL_CATEGORIES, category):
+            self._pools.setdefault(key, QuestionPool()).add(id)
+            self._levels.setdefault(key, {}).setdefault(
+                difficulty, QuestionPool()).add(id)
+
+    def pool(self, category):
+        self.warm()
+        return self._pools.get(category) or QuestionPool()
+
+    def _draw_level(self, category, excluded, difficulty):
+        # CALLER HOLDS THE LOCK
+        levels = self._levels.get(category, {})
+        for group in difficulty.levels(levels, len(excluded)):
+            id = draw_from([levels[d] for d in group], excluded)
+            if id is not None:
+                return id
+        return None
+
+    def draw(self, category, excluded, difficulty=None):
+        '''
+        draws from the live pool under the lock, so a concurrent add or
+        remove never moves ids in the middle of a draw. a DifficultyFilter
+        limits the draw to the pools of its difficulties.
+        '''
+        pool = self.pool(category)
+        with self._lock:
+            if difficulty is None:
+                return pool.draw(excluded)
+            return self._draw_level(category, excluded, difficulty)
+
+    def sample(self, category, count, excluded, difficulty=None):
+        pool = self.pool(category)
+        with self._lock:
+            if difficulty is None:
+                return pool.sample(count, excluded)
+            # ONE DRAW AT A TIME, SO A RAMP CLIMBS INSIDE THE BATCH TOO
+            excluded = set(excluded)
+            picked = []
+            while len(picked) < count:
+                id = self._draw_level(category, excluded, difficulty)
+                if id is None:
+                    break
+                picked.append(id)
+                excluded.add(id)
+            return picked
+
+    def remove(self, id):
+        self.change('delete', (id,))
+
+    def next_question(self, category, previous_questions, difficulty=None):
+        '''
+        returns a random formatted question in category (ALL_CATEGORIES
+        for any) that is not in previous_questions, or None once the quiz
+        is exhausted. only the columns of the drawn row are read.
+        '''
+        excluded = set(previous_questions)
+        while True:
+            id = self.draw(category, excluded, difficulty)
+            if id is None:
+                return None
+            row = project_questions(Question.query).filter(
+                Question.id == id).first()
+            if row is not None:
+                return format_row(row)
+            # ROW WAS DELETED BY ANOTHER WORKER, DROP IT AND DRAW AGAIN
+            self.remove(id)
+
+    def next_questions(self, category, previous_questions, count,
+                       difficulty=None):
+        '''
+        up to count distinct formatted questions in random order, none of
+        them in previous_questions. all drawn rows are read with a single
+        IN query; fewer than count means the category has run out.
+        '''
+        excluded = set(previous_questions)
+        questions = []
+        while len(questions) < count:
+            ids = self.sample(category, count - len(questions), excluded,
+                              difficulty)
+            if not ids:
+                break
+            rows = {row[0]: row for row in project_questions(
+                Question.query).filter(Question.id.in_(ids))}
+            for id in ids:
+                excluded.add(id)
+                if id in rows:
+                    questions.append(format_row(rows[id]))
+                else:
+                    self.remove(id)
+        return questions
+
+
+quiz_sampler = QuizSampler()
+on_change(quiz_sampler.on_change)
@@ -0,0 +1,38 @@
+import time
+
+from flask import request
+
+from models import db, engine_setting
+
+# UNIX TIME UNTIL WHICH THE CLIENT READS FROM THE PRIMARY
+PRIMARY_COOKIE = 'trivia_primary_until'
+
+'''
+init_replicas(app)
+    read-your-writes for apps with read replicas (models.ReplicaSet). a
+    request whose session wrote to the primary gets a cookie, and for the
+    next DB_REPLICA_STICKY seconds that client's reads skip the replicas,
+    so it never reads a replica that has not caught up with its own write.
+'''
+
+
+def init_replicas(app):
+    if app.extensions.get('replicas') is None:
+        return
+    sticky = engine_setting(app, 'DB_REPLICA_STICKY')
+
+    @app.before_request
+    def stick_to_primary():
+        try:
+            until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            return
+        if until > time.time():
+            db.session.info['primary'] = True
+
+    @app.after_request
+    def remember_write(response):
+        if db.session.info.get('wrote') and sticky > 0:
+            response.set_cookie(PRIMARY_COOKIE, str(time.time() + sticky),
+                                max_age=sticky, httponly=True)
+        return response
@@ -0,0 +1,158 @@
+import re
+from collections import Counter, defaultdict
+
+from sqlalchemy import func
+
+from models import Question, on_change
+from .indexes import ModelIndex
+from .pagination import paginate_ids, paginate_questions
+
+SEARCH_MODES = ('substring', 'fulltext')
+SEARCH_INDEX_TTL = 60
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'at', 'by', 'for', 'in', 'is', 'of', 'on', 'or',
+    'the', 'to', 'was', 'what', 'which', 'who', 'with'])
+
+
+def tokenize(text):
+    return [word for word in re.findall(r'\w+', (text or '').lower())
+            if word not in STOP_WORDS]
+
+
+def escape_like(term):
+    '''
+    term with the LIKE wildcards % and _ and the escape character \\
+    escaped, so it matches only itself
+    '''
+    return re.sub(r'([\\%_])', r'\\\1', term)
+
+
+def trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+'''
+InvertedIndex
+    in-process search index over question text, for databases without
+    full-text support: a ModelIndex over (id, question). words map to
+    ids with their term frequency, and character trigrams map to ids so
+    substring lookups only verify the candidates that contain every
+    trigram of the term. lookups collect their matches under the lock,
+    so a concurrent write never changes a set while it is being read.
+'''
+
+
+class InvertedIndex(ModelIndex):
+    model = Question
+    columns = ('id', 'question')
+
+    def __init__(self, ttl=SEARCH_INDEX_TTL):
+        super(InvertedIndex, self).__init__(ttl)
+
+    def clear(self):
+        self._texts = {}
+        self._words = defaultdict(dict)
+        self._trigrams = defaultdict(set)
+
+    def apply(self, action, row):
+        id = row[0]
+        text = self._texts.pop(id, None)
+        if text is not None:
+            for word in set(tokenize(text)):
+                self._words[word].pop(id, None)
+            for trigram in trigrams(text):
+                self._trigrams[trigram].discard(id)
+        if action == 'delete':
+            return
+        text = (row[1] or '').lower()
+        self._texts[id] = text
+        for word, count in Counter(tokenize(text)).items():
+            self._words[word][id] = count
+        for trigram in trigrams(text):
+            self._trigrams[trigram].add(id)
+
+    def substring(self, term):
+        '''
+        ids whose question contains term, case-insensitively, sorted by id
+        '''
+        self.warm()
+        term = term.lower()
+        grams = trigrams(term)
+        with self._lock:
+            if grams:
+                candidates = set.intersection(
+                    *[self._trigrams.get(gram, set()) for gram in grams])
+            else:
+                candidates = self._texts.keys()
+            ids = [id for id in candidates if term in self._texts[id]]
+        return sorted(ids)
+
+    def fulltext(self, term):
+        '''
+        ids whose question contains every word of term, best matches first
+        '''
+        self.warm()
+        words = tokenize(term)
+        if not words:
+            return []
+        with self._lock:
+            postings = [self._words.get(word, {}) for word in words]
+            ids = set.intersection(*[set(posting) for posting in postings])
+            scores = {id: sum(posting[id] for posting in postings)
+                      for id in ids}
+        return sorted(ids, key=lambda id: (-scores[id], id))
+
+
+'''
+QuestionSearch
+    ranked, paginated question search. on Postgres both modes run in the
+    database against GIN indexes (pg_trgm for substring, tsvector for
+    fulltext) created by `flask db upgrade`. anywhere else they are
+    answered by the InvertedIndex.
+'''
+
+
+class QuestionSearch(object):
+    def __init__(self):
+        self.index = InvertedIndex()
+        self.use_database = False
+
+    def configure(self, app):
+        backend = app.config.get('SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            backend = 'postgres' if app.config[
+                'SQLALCHEMY_DATABASE_URI'].startswith('postgres') \
+                else 'memory'
+        self.use_database = backend == 'postgres'
+        self.index.invalidate()
+
+    def warm(self):
+        if not self.use_database:
+            self.index.warm()
+
+    def search(self, request, term, mode='substring'):
+        if mode not in SEARCH_MODES:
+            raise ValueError('unknown search mode {}'.format(mode))
+        if self.use_database:
+            return self._search_database(request, term, mode)
+        if mode == 'substring':
+            return paginate_ids(request, self.index.substring(term))
+        return paginate_ids(request, self.index.fulltext(term), ranked=True)
+
+    def _search_database(self, request, term, mode):
+        if mode == 'substring':
+            # ILIKE '%term%' IS SERVED BY THE TRIGRAM INDEX
+            return paginate_questions(request, Question.query.filter(
+                Question.question.ilike('%{}%'.format(escape_like(term)),
+                                        escape='\\')))
+        document = func.to_tsvector(
+            'english', func.coalesce(Question.question, ''))
+        query = func.plainto_tsquery('english', term)
+        return paginate_questions(
+            request, Question.query.filter(document.op('@@')(query)),
+            order_by=(func.ts_rank(document, query).desc(), Question.id))
+
+
+question_search = QuestionSearch()
+on_change(question_search.index.on_change)
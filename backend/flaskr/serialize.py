@@ -0,0 +1,46 @@
+import json
+
+from flask import Response
+
+from models import Question
+from .metrics import timed_serialization
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+'''
+column projection
+    list endpoints select these columns as plain tuples instead of
+    loading Question objects into the session's identity map
+'''
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+
+def project_questions(query):
+    return query.with_entities(*QUESTION_COLUMNS)
+
+
+def format_row(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
+
+'''
+dumps(payload) / json_response(payload)
+    encode with orjson when it is installed, which is several times
+    faster than the stdlib encoder for large lists, otherwise with json
+'''
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    with timed_serialization():
+        body = dumps(payload)
+    return Response(body, status=status, mimetype='application/json')
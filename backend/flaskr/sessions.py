@@ -0,0 +1,165 @@
+import base64
+import json
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - redis is optional
+    redis = None
+
+QUIZ_SESSION_TTL = 3600
+
+'''
+PlayedSet
+    the question ids played in a session, kept as a sorted array of
+    unsigned ints: 4 bytes per played question, O(log n) lookups
+'''
+
+
+class PlayedSet(object):
+    def __init__(self, ids=()):
+        self._ids = array('I', sorted(set(ids)))
+
+    def __contains__(self, id):
+        position = bisect_left(self._ids, id)
+        return position < len(self._ids) and self._ids[position] == id
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, id):
+        if id not in self:
+            insort(self._ids, id)
+
+    def to_bytes(self):
+        return self._ids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        played = cls()
+        played._ids.frombytes(data)
+        return played
+
+
+'''
+QuizSession
+    one game in progress: the category being played and the ids already
+    served to the player
+'''
+
+
+class QuizSession(object):
+    def __init__(self, token, category, played=None):
+        self.token = token
+        self.category = category
+        self.played = played if played is not None else PlayedSet()
+
+    def to_json(self):
+        return json.dumps({
+            'category': self.category,
+            'played': base64.b64encode(self.played.to_bytes()).decode()
+        })
+
+    @classmethod
+    def from_json(cls, token, data):
+        data = json.loads(data)
+        played = PlayedSet.from_bytes(base64.b64decode(data['played']))
+        return cls(token, data['category'], played)
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+'''
+MemorySessionStore
+    sessions in a dict of this process, evicted ttl seconds after their
+    last use. only shared by the threads of a single worker.
+'''
+
+
+class MemorySessionStore(object):
+    def __init__(self, ttl=QUIZ_SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._next_sweep = time.monotonic() + ttl
+
+    def _sweep(self, now):
+        expired = [token for token, (expires_at, _) in self._sessions.items()
+                   if expires_at <= now]
+        for token in expired:
+            del self._sessions[token]
+        self._next_sweep = now + self.ttl
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._sessions.get(token)
+            if entry is None or entry[0] <= now:
+                self._sessions.pop(token, None)
+                return None
+            return entry[1]
+
+    def put(self, session):
+        with self._lock:
+            self._sessions[session.token] = (
+                time.monotonic() + self.ttl, session)
+
+    def delete(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+
+'''
+RedisSessionStore
+    sessions in any Redis-compatible server so every worker sees the
+    same games. expiry is left to the server through SETEX.
+'''
+
+
+class RedisSessionStore(object):
+    def __init__(self, url, ttl=QUIZ_SESSION_TTL, prefix='trivia:quiz:'):
+        if redis is None:
+            raise RuntimeError(
+                'the redis package is required for QUIZ_SESSION_STORE={}'
+                .format(url))
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, token):
+        data = self._client.get(self.prefix + token)
+        if data is None:
+            return None
+        return QuizSession.from_json(token, data)
+
+    def put(self, session):
+        self._client.setex(
+            self.prefix + session.token, self.ttl, session.to_json())
+
+    def delete(self, token):
+        self._client.delete(self.prefix + token)
+
+
+'''
+session_store_from_config(config)
+    QUIZ_SESSION_STORE is 'memory' (the default) or a redis:// URL
+'''
+
+
+def session_store_from_config(config):
+    url = config.get('QUIZ_SESSION_STORE', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+    if url == 'memory':
+        return MemorySessionStore(ttl)
+    return RedisSessionStore(url, ttl)
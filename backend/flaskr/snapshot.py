@@ -0,0 +1,382 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+from flask import current_app, g, has_app_context, has_request_context
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from models import Category, Question, db, on_change
+from .compression import compress
+from .export import EXPORT_BATCH
+from .pagination import QUESTIONS_PER_PAGE
+from .serialize import dumps, format_row, project_questions
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no flock on windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MANIFEST = 'manifest.json'
+# HELD WHILE FILES ARE WRITTEN, SO WORKERS OF ONE SERVER TAKE TURNS
+SNAPSHOT_LOCK = 'manifest.lock'
+# A CHANGE THAT UPDATES CANNOT FOLLOW, EVERY FILE IS WRITTEN AGAIN
+REBUILD = 'rebuild'
+QUESTIONS_LISTING = 'questions'
+CATEGORY_LISTING = 'categories/{}/questions'
+
+'''
+Snapshot
+    the browse endpoints materialized as static files under root, for a
+    CDN or nginx to serve without Python:
+
+        categories.json                  GET /categories
+        questions/<page>.json            GET /questions?page=<page>
+        categories/<id>/questions/<page>.json
+                                         GET /categories/<id>/questions?...
+
+    each file holds the body the endpoint would return, plus a .gz twin
+    when gzip is set. manifest.json lists every file with its size and
+    etag and the page count of every listing.
+
+    build() writes everything from one id-ordered pass per listing.
+    update(changes) follows question inserts and deletes: pages are id
+    ordered, so only the pages from the lowest changed id onward change,
+    in /questions and in the categories written to, each listing once
+    however many rows changed. pages before it only get their
+    total_questions rewritten, without reading the database. both hold
+    an flock on manifest.lock, so the workers of one server never write
+    the files at the same time.
+'''
+
+
+class Snapshot(object):
+    def __init__(self, root, per_page=QUESTIONS_PER_PAGE, gzip=False):
+        self.root = root
+        self.per_page = per_page
+        self.gzip = gzip
+        self._lock = threading.Lock()
+        self.files = {}
+        self.pages = {}
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, SNAPSHOT_LOCK), 'a') as lock:
+                if fcntl is not None:
+                    # RELEASED WHEN THE FILE IS CLOSED
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def page_name(self, listing, page):
+        return '{}/{}.json'.format(listing, page)
+
+    def write(self, name, payload):
+        body = dumps(payload)
+        self._write_file(name, body)
+        if self.gzip:
+            self._write_file(name + '.gz', compress(body, 'gzip'))
+        self.files[name] = {
+            'bytes': len(body),
+            'etag': hashlib.sha1(body).hexdigest()[:20]}
+
+    def _write_file(self, name, body):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # WRITE THEN RENAME, SO THE EDGE NEVER SERVES HALF A FILE
+        with open(path + '.tmp', 'wb') as out:
+            out.write(body)
+        os.replace(path + '.tmp', path)
+
+    def remove(self, name):
+        self.files.pop(name, None)
+        for path in (name, name + '.gz'):
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+
+    def load_manifest(self):
+        '''
+        the files and pages of the last build, False when there is none
+        '''
+        try:
+            with open(os.path.join(self.root, SNAPSHOT_MANIFEST)) as source:
+                manifest = json.load(source)
+        except FileNotFoundError:
+            return False
+        if manifest.get('per_page') != self.per_page:
+            return False
+        self.files = manifest['files']
+        self.pages = manifest['pages']
+        return True
+
+    def save_manifest(self):
+        self._write_file(SNAPSHOT_MANIFEST, json.dumps({
+            'generated_at': int(time.time()),
+            'per_page': self.per_page,
+            'pages': self.pages,
+            'files': self.files,
+        }, indent=1, sort_keys=True).encode('utf-8'))
+
+    def categories(self):
+        return [category.format() for category in
+                Category.query.order_by(Category.id).all()]
+
+    def build(self):
+        with self.locked():
+            self.load_manifest()
+            old_files = set(self.files)
+            self.files, self.pages = {}, {}
+            categories = self.categories()
+            types = [category['type'] for category in categories]
+            self.write('categories.json', {'categories': types})
+            totals = dict(db.session.query(
+                Question.category, func.count(Question.id)).group_by(
+                Question.category).all())
+            self.write_pages(QUESTIONS_LISTING, Question.query,
+                             sum(totals.values()), types, 1, 0)
+            for category in categories:
+                self.write_pages(
+                    CATEGORY_LISTING.format(category['id']),
+                    Question.query.filter_by(category=category['id']),
+                    totals.get(category['id'], 0), types, 1, 0,
+                    category['type'])
+            # PAGES AND CATEGORIES THE LAST BUILD HAD AND THIS ONE DOES NOT
+            for name in old_files - set(self.files):
+                self.remove(name)
+            self.save_manifest()
+
+    def update(self, changes):
+        '''
+        applies [(id, category)] question inserts and deletes, False when
+        there is no build to update
+        '''
+        with self.locked():
+            # ANOTHER WORKER MAY HAVE WRITTEN SINCE, START FROM THE FILES
+            if not self.load_manifest():
+                return False
+            categories = self.categories()
+            types = [category['type'] for category in categories]
+            first_ids = {}
+            for id, category in changes:
+                first_ids[category] = min(id, first_ids.get(category, id))
+            self.refresh(QUESTIONS_LISTING, Question.query,
+                         min(first_ids.values()), types)
+            for category in categories:
+                if category['id'] in first_ids:
+                    self.refresh(
+                        CATEGORY_LISTING.format(category['id']),
+                        Question.query.filter_by(category=category['id']),
+                        first_ids[category['id']], types, category['type'])
+            self.save_manifest()
+            return True
+
+    def apply(self, changes):
+        '''
+        update(changes), or build() when one of them is a REBUILD
+        '''
+        if REBUILD in changes:
+            self.build()
+        elif changes:
+            self.update(changes)
+
+    def refresh(self, listing, query, id, types, current_category=None):
+        # ID ORDER: EVERY PAGE BEFORE THE ONE HOLDING id KEEPS ITS ROWS
+        position = query.filter(Question.id < id).order_by(None).count()
+        total = query.order_by(None).count()
+        first_page = position // self.per_page + 1
+        last_page = self.pages.get(listing, 0)
+        for page in range(1, min(first_page, last_page + 1)):
+            name = self.page_name(listing, page)
+            with open(os.path.join(self.root, name), 'rb') as source:
+                payload = json.load(source)
+            payload['total_questions'] = total
+            self.write(name, payload)
+        self.write_pages(listing, query, total, types, first_page,
+                         last_page, current_category)
+
+    def write_pages(self, listing, query, total, types, first_page,
+                    old_last_page, current_category=None):
+        '''
+        writes the pages of listing from first_page to the end, from one
+        streamed query, and removes pages the listing no longer has
+        '''
+        rows = project_questions(query).order_by(Question.id).offset(
+            (first_page - 1) * self.per_page).yield_per(EXPORT_BATCH)
+        page = first_page
+        questions = []
+        for row in rows:
+            questions.append(format_row(row))
+            if len(questions) == self.per_page:
+                self.write_page(listing, page, questions, total, types,
+                                current_category)
+                page += 1
+                questions = []
+        # AN EMPTY CATEGORY STILL HAS ITS FIRST PAGE, /questions DOES NOT
+        if questions or (page == 1 and current_category is not None):
+            self.write_page(listing, page, questions, total, types,
+                            current_category)
+            page += 1
+        last_page = page - 1
+        for stale in range(last_page + 1, old_last_page + 1):
+            self.remove(self.page_name(listing, stale))
+        self.pages[listing] = last_page
+
+    def write_page(self, listing, page, questions, total, types,
+                   current_category=None):
+        next_after_id = None
+        if len(questions) == self.per_page:
+            next_after_id = questions[-1]['id']
+        if current_category is None:
+            payload = {
+                'questions': questions,
+                'total_questions': total,
+                'categories': types,
+                'current_category': [question['category']
+                                     for question in questions],
+                'next_after_id': next_after_id
+            }
+        else:
+            payload = {
+                'categories': types,
+                'current_category': current_category,
+                'questions': questions,
+                'total_questions': total,
+                'next_after_id': next_after_id
+            }
+        self.write(self.page_name(listing, page), payload)
+
+
+def snapshot_from_config(config, root=None, gzip=None):
+    root = root or config.get('SNAPSHOT_DIR')
+    if not root:
+        return None
+    if gzip is None:
+        gzip = config.get('SNAPSHOT_GZIP', False)
+    return Snapshot(root, gzip=gzip)
+
+
+'''
+SnapshotWriter
+    applies the snapshot changes of an app on one thread per process,
+    after the responses of the requests that made them. whatever queued
+    up while it was writing goes out in a single update, and a failed
+    write is logged, never raised: the next build or `flask snapshot`
+    puts the files right. changes still queued when the process exits
+    are lost the same way.
+'''
+
+
+class SnapshotWriter(object):
+    def __init__(self, app):
+        self.app = app
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, changes):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='snapshot-writer', daemon=True)
+                self._thread.start()
+        self._queue.put(changes)
+
+    def join(self):
+        '''
+        waits until everything submitted so far is written
+        '''
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batches = [self._queue.get()]
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    try:
+                        self.write([change for batch in batches
+                                    for change in batch])
+                    finally:
+                        db.session.remove()
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+    def write(self, changes):
+        snapshot = self.app.extensions.get('snapshot')
+        if snapshot is None:
+            return
+        try:
+            snapshot.apply(changes)
+        except Exception:
+            logger.exception('snapshot update failed in %s', snapshot.root)
+
+
+'''
+init_snapshot(app)
+    with SNAPSHOT_DIR set, keeps the snapshot there in step with the
+    question writes this app commits (see sync_snapshot). the changes of
+    a request are handed to the app's SnapshotWriter once it ends.
+'''
+
+
+def init_snapshot(app):
+    app.extensions['snapshot'] = snapshot_from_config(app.config)
+    writer = app.extensions['snapshot_writer'] = SnapshotWriter(app)
+
+    @app.teardown_request
+    def queue_snapshot_changes(error=None):
+        changes = g.pop('snapshot_changes', None)
+        if changes:
+            writer.submit(changes)
+
+
+@on_change
+def sync_snapshot(model, action):
+    if not has_app_context() or \
+            current_app.extensions.get('snapshot') is None:
+        return
+    if isinstance(model, Question) and action in ('insert', 'delete'):
+        change = (model.id, model.category)
+    elif isinstance(model, (Question, Category)) or \
+            model in (Question, Category):
+        # AN UPDATE MAY MOVE A QUESTION BETWEEN CATEGORIES, AND A
+        # CATEGORY CHANGE SHOWS ON EVERY PAGE: REBUILD ALL OF IT
+        change = REBUILD
+    else:
+        return
+    if has_request_context():
+        g.setdefault('snapshot_changes', []).append(change)
+    else:
+        # A COMMAND OR SCRIPT, NO RESPONSE TO WAIT FOR
+        current_app.extensions['snapshot_writer'].write([change])
+
+
+@click.command('snapshot')
+@click.argument('root', required=False)
+@click.option('--gzip/--no-gzip', default=None,
+              help='Also write a .gz file next to every page.')
+@with_appcontext
+def snapshot_command(root, gzip):
+    """Write every browse page as static JSON plus a manifest."""
+    snapshot = snapshot_from_config(current_app.config, root, gzip)
+    if snapshot is None:
+        raise click.UsageError('pass a directory or set SNAPSHOT_DIR')
+    snapshot.build()
+    click.echo('wrote {} files to {}'.format(
+        len(snapshot.files), snapshot.root))
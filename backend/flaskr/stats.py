@@ -0,0 +1,78 @@
+from flask import g, has_app_context
+from sqlalchemy import Column, Integer, MetaData, Table, select
+
+from models import db, on_change
+
+# HOW question_counts STORES A NULL CATEGORY OR DIFFICULTY
+NO_VALUE = -1
+
+'''
+question_counts
+    one row per (category, difficulty) with its number of questions,
+    written by database triggers (migration 0006) in the same transaction
+    as the question rows. kept out of db.Model, the migrations own it.
+'''
+question_counts = Table(
+    'question_counts', MetaData(),
+    Column('category', Integer, primary_key=True),
+    Column('difficulty', Integer, primary_key=True),
+    Column('total', Integer))
+
+'''
+QuestionStats
+    question counts by (category, difficulty), read from question_counts:
+    a handful of rows instead of a COUNT over the questions, and exact
+    whichever worker or import wrote last. a request reads the table at
+    most once, and again after a write it commits.
+'''
+
+
+class QuestionStats(object):
+    def _load(self):
+        rows = db.session.execute(select([
+            question_counts.c.category, question_counts.c.difficulty,
+            question_counts.c.total]).where(question_counts.c.total > 0))
+        return {(None if category == NO_VALUE else category,
+                 None if difficulty == NO_VALUE else difficulty): total
+                for category, difficulty, total in rows}
+
+    def counts(self):
+        '''
+        {(category, difficulty): count} for every pair with questions
+        '''
+        if not has_app_context():
+            return self._load()
+        if 'question_counts' not in g:
+            g.question_counts = self._load()
+        return g.question_counts
+
+    def total(self, category=None, difficulty=None):
+        return sum(count for (row_category, row_difficulty), count
+                   in self.counts().items()
+                   if (category is None or row_category == category) and
+                   (difficulty is None or row_difficulty == difficulty))
+
+    def difficulties(self, category=None):
+        '''
+        [(difficulty, count)] in difficulty order, over one category or
+        over all of them
+        '''
+        totals = {}
+        for (row_category, difficulty), count in self.counts().items():
+            if category is None or row_category == category:
+                totals[difficulty] = totals.get(difficulty, 0) + count
+        return sorted(totals.items(),
+                      key=lambda item: (item[0] is None, item[0] or 0))
+
+    def invalidate(self):
+        if has_app_context():
+            g.pop('question_counts', None)
+
+
+question_stats = QuestionStats()
+
+
+@on_change
+def sync_question_stats(model, action):
+    # THE TRIGGERS ALREADY COUNTED THE WRITE, ONLY FORGET THIS REQUEST'S READ
+    question_stats.invalidate()
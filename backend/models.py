@@ -1,23 +1,291 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, event, orm, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import Select
+from sqlalchemy.pool import StaticPool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = "trivia"
-database_path = "postgresql://{}:{}@{}/{}".format('postgres', '0000', 'localhost:5432', database_name)
+database_path = os.environ.get(
+    'DATABASE_URL',
+    "postgresql://{}:{}@{}/{}".format('postgres', '0000', 'localhost:5432', database_name))
+DEFAULT_DATABASE_PATH = database_path
 
-db = SQLAlchemy()
+'''
+RoutingSession
+    sends plain SELECTs to a healthy read replica of the app, if it has
+    any (see ReplicaSet), and everything else to the primary: flushes,
+    INSERT/UPDATE/DELETE, raw SQL, SELECT ... FOR UPDATE and bare
+    connection() calls. once a session has written, or info['primary']
+    is set, all of its reads stay on the primary too. the replica is
+    picked once per session and kept in info['replica'], so the reads of
+    one request see one replica's state; it is only picked again if that
+    replica goes down.
+'''
+class RoutingSession(SignallingSession):
+  def get_bind(self, mapper=None, clause=None):
+    replicas = self.app.extensions.get('replicas')
+    if replicas is not None and self.reads_from_replica(clause):
+      engine = self.info.get('replica')
+      if engine is None or not replicas.is_up(engine):
+        engine = self.info['replica'] = replicas.pick()
+      if engine is not None:
+        return engine
+    if not isinstance(clause, Select) or self._flushing:
+      self.info['wrote'] = True
+    return SignallingSession.get_bind(self, mapper, clause)
+
+  def reads_from_replica(self, clause):
+    return (isinstance(clause, Select) and clause._for_update_arg is None
+            and not self._flushing and not self.info.get('wrote')
+            and not self.info.get('primary'))
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+
+'''
+engine settings
+    read from app.config (e.g. create_app(test_config)) first, then from
+    the environment, then these defaults. DB_STATEMENT_TIMEOUT is in
+    milliseconds, 0 disables it. pool settings only apply to Postgres.
+    DB_AUTO_UPGRADE applies pending migrations in create_app. a replica
+    that failed is left out for DB_REPLICA_RETRY seconds, and a client
+    that wrote reads from the primary for DB_REPLICA_STICKY seconds.
+'''
+ENGINE_DEFAULTS = {
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    'DB_STATEMENT_TIMEOUT': 0,
+    'DB_SQLITE_WAL': True,
+    'DB_AUTO_UPGRADE': False,
+    'DB_REPLICA_RETRY': 30,
+    'DB_REPLICA_STICKY': 5,
+}
+
+def engine_setting(app, key):
+    if key in app.config:
+        return app.config[key]
+    default = ENGINE_DEFAULTS[key]
+    value = os.environ.get(key)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return type(default)(value)
+
+def is_sqlite_memory(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+'''
+resolve_sqlite_uri(app, uri)
+    a relative sqlite:///file.db made absolute against app.root_path, the
+    way flask_sqlalchemy resolves the primary, so every engine opens the
+    same file whatever the working directory. other uris are unchanged.
+'''
+def resolve_sqlite_uri(app, uri):
+    url = make_url(uri)
+    if not url.drivername.startswith('sqlite') or is_sqlite_memory(uri) \
+            or not url.database or os.path.isabs(url.database):
+        return uri
+    url.database = os.path.join(app.root_path, url.database)
+    return str(url)
+
+def engine_options(app, uri):
+    if uri.startswith('sqlite'):
+        if is_sqlite_memory(uri):
+            # ONE SHARED CONNECTION, OTHERWISE EVERY THREAD SEES AN EMPTY DB
+            return {
+                'poolclass': StaticPool,
+                'connect_args': {'check_same_thread': False}
+            }
+        return {'connect_args': {'check_same_thread': False, 'timeout': 30}}
+    options = {
+        'pool_size': engine_setting(app, 'DB_POOL_SIZE'),
+        'max_overflow': engine_setting(app, 'DB_MAX_OVERFLOW'),
+        'pool_timeout': engine_setting(app, 'DB_POOL_TIMEOUT'),
+        'pool_recycle': engine_setting(app, 'DB_POOL_RECYCLE'),
+        'pool_pre_ping': engine_setting(app, 'DB_POOL_PRE_PING'),
+    }
+    statement_timeout = engine_setting(app, 'DB_STATEMENT_TIMEOUT')
+    if statement_timeout and uri.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
+
+def sqlite_pragmas(wal):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal:
+            # READERS DO NOT BLOCK THE WRITER AND THE OTHER WAY ROUND
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+    return set_pragmas
+
+'''
+ReplicaSet
+    the read replicas of an app, handed out round-robin. a replica is
+    probed with SELECT 1 before its first use and before it is used again
+    after a failure; a connection error marks it down for retry_after
+    seconds. pick() returns None when every replica is down, and reads
+    then fall back to the primary.
+'''
+class ReplicaSet(object):
+  def __init__(self, engines, retry_after):
+    self.engines = engines
+    self.retry_after = retry_after
+    self._lock = threading.Lock()
+    self._next = 0
+    # ENGINE INDEX -> MONOTONIC TIME IT MAY BE PROBED AGAIN, 0 = HEALTHY
+    self._down_until = dict((index, None) for index in range(len(engines)))
+    for engine in engines:
+      event.listen(engine, 'handle_error', self._handle_error(engine))
+
+  def _handle_error(self, engine):
+    def handle_error(context):
+      # is_disconnect, OR NO CONNECTION AT ALL: THE REPLICA IS UNREACHABLE
+      if context.is_disconnect or context.connection is None:
+        self.mark_down(engine)
+    return handle_error
+
+  def mark_down(self, engine):
+    with self._lock:
+      self._down_until[self.engines.index(engine)] = \
+        time.monotonic() + self.retry_after
+
+  def is_up(self, engine):
+    with self._lock:
+      return self._down_until[self.engines.index(engine)] == 0
+
+  def probe(self, engine):
+    try:
+      with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    except Exception:
+      self.mark_down(engine)
+      return False
+    with self._lock:
+      self._down_until[self.engines.index(engine)] = 0
+    return True
+
+  def healthy(self):
+    with self._lock:
+      return [self.engines[index] for index, until
+              in sorted(self._down_until.items()) if until == 0]
+
+  def pick(self):
+    now = time.monotonic()
+    for _ in range(len(self.engines)):
+      with self._lock:
+        index = self._next
+        self._next = (index + 1) % len(self.engines)
+        until = self._down_until[index]
+      engine = self.engines[index]
+      if until == 0:
+        return engine
+      # NEVER CHECKED, OR ITS RETRY TIME HAS COME
+      if (until is None or until <= now) and self.probe(engine):
+        return engine
+    return None
+
+def replica_uris(app):
+  uris = app.config.get('SQLALCHEMY_REPLICA_URIS')
+  if uris is None:
+    uris = os.environ.get('DATABASE_REPLICA_URLS', '')
+  if isinstance(uris, str):
+    uris = [uri.strip() for uri in uris.split(',')]
+  return [uri for uri in uris if uri]
+
+def create_replica_set(app):
+  engines = []
+  for uri in replica_uris(app):
+    uri = resolve_sqlite_uri(app, uri)
+    engine = create_engine(uri, **engine_options(app, uri))
+    if uri.startswith('sqlite'):
+      event.listen(engine, 'connect', sqlite_pragmas(
+        engine_setting(app, 'DB_SQLITE_WAL') and not is_sqlite_memory(uri)))
+    engines.append(engine)
+  if not engines:
+    return None
+  return ReplicaSet(engines, engine_setting(app, 'DB_REPLICA_RETRY'))
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. the database is
+    database_path if given, else SQLALCHEMY_DATABASE_URI from app.config,
+    else DATABASE_URL from the environment, else the local trivia db.
+    sqlite:///file.db and sqlite:// (in memory) are supported besides
+    Postgres. nothing connects until the first query, and the schema is
+    left to `flask db upgrade` (flaskr/migrations.py). read replicas come
+    from SQLALCHEMY_REPLICA_URIS in app.config or the comma separated
+    DATABASE_REPLICA_URLS.
 '''
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    uri = database_path or app.config.get(
+        "SQLALCHEMY_DATABASE_URI") or DEFAULT_DATABASE_PATH
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, uri)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if uri.startswith('sqlite'):
+        engine = db.get_engine(app)
+        event.listen(engine, 'connect', sqlite_pragmas(
+            engine_setting(app, 'DB_SQLITE_WAL') and not is_sqlite_memory(uri)))
+    app.extensions['replicas'] = create_replica_set(app)
+
+'''
+on_change(listener)
+    registers listener(model, action) to run after a write on a model
+    has been committed. action is one of 'insert', 'update' or 'delete',
+    or 'bulk' with the model class after rows were written without
+    instances (bulk inserts, COPY), meaning any derived data is stale.
+'''
+change_listeners = []
+
+def on_change(listener):
+    change_listeners.append(listener)
+    return listener
+
+def notify_change(model, action):
+    for listener in change_listeners:
+        listener(model, action)
+
+'''
+insert_all(models) / delete_all(models)
+    write many rows in a single transaction. nothing is written if any
+    row fails, and change listeners only run after the commit.
+'''
+def insert_all(models):
+    try:
+        db.session.add_all(models)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    for model in models:
+        notify_change(model, 'insert')
+
+def delete_all(models):
+    try:
+        for model in models:
+            db.session.delete(model)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    for model in models:
+        notify_change(model, 'delete')
 
 '''
 Question
@@ -25,29 +293,43 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # KEEP IN STEP WITH flaskr/migrations.py, WHICH ADDS THESE TO OLD DATABASES
+  __table_args__ = (
+    Index('questions_category_id_idx', 'category', 'id'),
+    Index('questions_difficulty_idx', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(Integer)
+  category = Column(Integer, ForeignKey(
+    'categories.id', name='questions_category_fkey',
+    onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
+  # OTHER ANSWERS GRADED AS CORRECT, SEPARATED BY |, NEVER SENT TO CLIENTS
+  answer_aliases = Column(String)
 
-  def __init__(self, question, answer, category, difficulty):
+  def __init__(self, question, answer, category, difficulty,
+               answer_aliases=None):
     self.question = question
     self.answer = answer
     self.category = category
     self.difficulty = difficulty
+    self.answer_aliases = answer_aliases
 
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    notify_change(self, 'insert')
   
   def update(self):
     db.session.commit()
+    notify_change(self, 'update')
 
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+    notify_change(self, 'delete')
 
   def format(self):
     return {
@@ -71,6 +353,20 @@ class Category(db.Model):
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+    notify_change(self, 'insert')
+
+  def update(self):
+    db.session.commit()
+    notify_change(self, 'update')
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+    notify_change(self, 'delete')
+
   def format(self):
     return {
       'id': self.id,
@@ -2,32 +2,55 @@ import os
 import unittest
 import json
 import random
+import gc
+import sqlite3
+import gzip
+import tempfile
+import threading
+import time
 
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, inspect
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.admission import AdmissionLimiter
+from flaskr.asgi import AsgiApp, AsgiTestClient
+from flaskr.cache import category_cache
+from flaskr.compression import compressed_cache
+from flaskr.grading import normalize_answer, parse_aliases
+from flaskr.migrations import MIGRATIONS, upgrade
+from flaskr.quiz import quiz_sampler
+from flaskr.replicas import PRIMARY_COOKIE
+from flaskr.search import SEARCH_INDEX_TTL, escape_like, question_search
+from flaskr.snapshot import Snapshot
+from flaskr.stats import question_stats
+from models import ReplicaSet, db, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
-    def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgresql://{}:{}@{}/{}".\
-            format('postgres', '0000', 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+    @classmethod
+    def setUpClass(cls):
+        """Build the app once, the schema comes from `flask db upgrade`."""
+        cls.database_name = "trivia_test"
+        cls.database_path = os.environ.get(
+            'TEST_DATABASE_URL', "postgresql://{}:{}@{}/{}".format(
+                'postgres', '0000', 'localhost:5432', cls.database_name))
+        cls.app = create_app({'SQLALCHEMY_DATABASE_URI': cls.database_path})
+        cls.client = cls.app.test_client
+        cls.asgi_client = None
+        if os.environ.get('TEST_ASGI'):
+            # RUN THE SAME TESTS THROUGH THE ASGI ENTRY POINT
+            cls.asgi_client = AsgiTestClient(AsgiApp(cls.app))
+            cls.client = lambda self: self.asgi_client
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.asgi_client is not None:
+            cls.asgi_client.close()
 
+    def setUp(self):
+        """Define test variables."""
         self.new_question = {
             "question": "What actor did author Anne Rice first denounce, then praise in the role of her beloved Lestat?",
             "answer": "Tom Cruise",
@@ -61,6 +84,142 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'content not found')
 
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['categories']), 6)
+
+    def test_category_write_invalidates_cache(self):
+        """TEST CATEGORY CACHE INVALIDATION"""
+        self.client().get('/categories')
+        version = category_cache.version
+        with self.app.app_context():
+            category = Category(type='Music')
+            category.insert()
+            res = self.client().get('/categories')
+            data = json.loads(res.data)
+            category.delete()
+
+        self.assertEqual(category_cache.version, version + 2)
+        self.assertIn('Music', data['categories'])
+
+    def test_304_unchanged_questions(self):
+        res = self.client().get('/questions')
+        etag = res.headers['ETag']
+        res = self.client().get(
+            '/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_write_changes_etag(self):
+        etag = self.client().get('/categories').headers['ETag']
+        self.client().post(
+            '/questions?return=minimal', json=self.new_question)
+        res = self.client().get(
+            '/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_server_timing_and_metrics(self):
+        res = self.client().get('/questions')
+        timing = res.headers['Server-Timing']
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertIn('db;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'trivia_request_duration_seconds_count{endpoint="get_questions"}',
+            body)
+
+    def test_get_questions_after_id(self):
+        """TEST KEYSET PAGINATION"""
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get(
+            '/questions?after_id={}'.format(first['next_after_id']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], first['total_questions'])
+        self.assertTrue(
+            data['questions'][0]['id'] > first['questions'][-1]['id'])
+
+    def test_export_questions_ndjson(self):
+        res = self.client().get('/questions/export?category=5')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            len(rows), Question.query.filter_by(category=5).count())
+        self.assertTrue(all(row['category'] == 5 for row in rows))
+
+    def test_export_questions_csv(self):
+        res = self.client().get('/questions/export?format=csv&difficulty=4')
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty,'
+                                   'answer_aliases')
+        self.assertEqual(len(lines) - 1,
+                         Question.query.filter_by(difficulty=4).count())
+
+    def test_400_export_unknown_format(self):
+        res = self.client().get('/questions/export?format=xml')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_export_filter_not_a_number(self):
+        for query in ('category=abc', 'difficulty=x'):
+            res = self.client().get('/questions/export?' + query)
+
+            self.assertEqual(res.status_code, 400, query)
+
+    def test_import_questions(self):
+        total = Question.query.count()
+        body = '\n'.join(json.dumps(row) for row in [
+            self.new_question,
+            dict(self.new_question, difficulty=9),
+            dict(self.new_question, category=None)])
+        res = self.client().post('/questions/import', data=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([reject['line'] for reject in data['rejects']],
+                         [2, 3])
+        self.assertEqual(Question.query.count(), total + 1)
+
+    def test_import_rejects_malformed_line_and_continues(self):
+        total = Question.query.count()
+        body = '\n'.join([json.dumps(self.new_question), '{"question": ',
+                          json.dumps(self.new_question)])
+        res = self.client().post('/questions/import', data=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual([reject['line'] for reject in data['rejects']], [2])
+        self.assertEqual(Question.query.count(), total + 2)
+
+    def test_import_reports_lines_of_failed_batch(self):
+        taken = Question.query.order_by(Question.id).first().id
+        body = '\n'.join(json.dumps(row) for row in [
+            self.new_question,
+            dict(self.new_question, id=taken),
+            self.new_question])
+        res = self.client().post('/questions/import?batch_size=2', data=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([reject['line'] for reject in data['rejects']],
+                         [1, 2])
+
     def test_delete_question(self):
         """TEST DELETE QUESTION"""
         res = self.client().delete('/questions/22')
@@ -94,6 +253,46 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['created'])
         self.assertTrue(data['total_questions'])
 
+    def test_create_new_question_minimal(self):
+        res = self.client().post(
+            '/questions?return=minimal', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['created'])
+        self.assertNotIn('questions', data)
+
+    def test_batch_create_and_delete_questions(self):
+        total = Question.query.count()
+        res = self.client().post(
+            '/questions/batch',
+            json={"questions": [self.new_question, self.new_question]})
+        created = json.loads(res.data)['created']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(Question.query.count(), total + 2)
+
+        res = self.client().delete(
+            '/questions?return=minimal', json={"ids": created})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], sorted(created))
+        self.assertEqual(Question.query.count(), total)
+
+    def test_422_batch_create_is_all_or_nothing(self):
+        total = Question.query.count()
+        res = self.client().post(
+            '/questions/batch',
+            json={"questions": [self.new_question,
+                                dict(self.new_question, answer=None)]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Question.query.count(), total)
+
     def test_405_create_new_question_not_allowed(self):
         res = self.client().post('/questions/30', json=self.new_question)
         # print('response: ',res)
@@ -112,6 +311,27 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(len(data['questions']), 2)
 
+    def test_search_sees_writes_from_other_workers(self):
+        self.client().post('/questions', json={"searchTerm": "title"})
+        # A ROW WRITTEN WITHOUT THE CHANGE HOOKS, AS ANOTHER WORKER WOULD
+        db.session.execute(
+            "INSERT INTO questions (question, answer, category, difficulty)"
+            " VALUES ('Which zanzibarite was hidden?', 'None', 1, 1)")
+        db.session.commit()
+        question_search.index.ttl = 0
+        try:
+            res = self.client().post(
+                '/questions', json={"searchTerm": "zanzibarite"})
+        finally:
+            question_search.index.ttl = SEARCH_INDEX_TTL
+            db.session.execute(
+                "DELETE FROM questions WHERE question LIKE '%zanzibarite%'")
+            db.session.commit()
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+
     def test_invalid_search_questions(self):
         res = self.client().post('/questions', json={"searchTerm": "sunlight"})
         data = json.loads(res.data)
@@ -120,6 +340,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['total_questions'], 0)
         self.assertEqual(len(data['questions']), 0)
 
+    def test_fulltext_search_questions(self):
+        res = self.client().post(
+            '/questions',
+            json={"searchTerm": "soccer world cup", "searchMode": "fulltext"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+
+    def test_422_search_unknown_mode(self):
+        res = self.client().post(
+            '/questions', json={"searchTerm": "title", "searchMode": "regex"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_get_questions_by_category(self):
         res = self.client().get('/categories/5/questions')
         data = json.loads(res.data)
@@ -131,6 +368,51 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(len(data['questions']))
 
+    def test_stats_follow_writes(self):
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+        science = data['categories'][0]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], Question.query.count())
+        self.assertEqual(science['total_questions'],
+                         Question.query.filter_by(category=1).count())
+        self.assertEqual(
+            sum(row['total_questions'] for row in data['difficulties']),
+            data['total_questions'])
+
+        created = json.loads(self.client().post(
+            '/questions?return=minimal', json=self.new_question).data)
+        res = self.client().get('/categories/5/questions')
+        self.assertEqual(json.loads(res.data)['total_questions'],
+                         Question.query.filter_by(category=5).count())
+
+        self.client().delete('/questions/{}'.format(created['created']))
+        res = self.client().get('/stats')
+        self.assertEqual(json.loads(res.data)['total_questions'],
+                         data['total_questions'])
+
+    def test_stats_see_writes_from_other_workers(self):
+        before = json.loads(self.client().get('/stats').data)
+        # A ROW WRITTEN WITHOUT THE CHANGE HOOKS, AS ANOTHER WORKER WOULD
+        db.session.execute(
+            "INSERT INTO questions (question, answer, category, difficulty)"
+            " VALUES ('Counted?', 'Yes', 2, 1)")
+        db.session.commit()
+        try:
+            after = json.loads(self.client().get('/stats').data)
+            listing = json.loads(
+                self.client().get('/categories/2/questions').data)
+        finally:
+            db.session.execute("DELETE FROM questions WHERE question = "
+                               "'Counted?'")
+            db.session.commit()
+
+        self.assertEqual(after['total_questions'],
+                         before['total_questions'] + 1)
+        self.assertEqual(listing['total_questions'],
+                         Question.query.filter_by(category=2).count() + 1)
+
     def test_404_get_questions_beyond_category_ids(self):
         res = self.client().get('/categories/15/questions')
         # print('response:',res)
@@ -156,6 +438,546 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['question'])
 
+    def test_play_excludes_previous_questions(self):
+        ids = [question.id for question in
+               Question.query.filter_by(category=5).all()]
+        res = self.client().post(
+            '/quizzes',
+            json={
+                "previous_questions": ids[1:],
+                "quiz_category": {
+                    "id": 5,
+                    "type": "Entertainment"}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], ids[0])
+        self.assertFalse(data['exhausted'])
+
+    def test_play_exhausted(self):
+        ids = [question.id for question in
+               Question.query.filter_by(category=5).all()]
+        res = self.client().post(
+            '/quizzes',
+            json={
+                "previous_questions": ids,
+                "quiz_category": {
+                    "id": 5,
+                    "type": "Entertainment"}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question'], None)
+        self.assertTrue(data['exhausted'])
+
+    def test_play_batch(self):
+        ids = [question.id for question in
+               Question.query.filter_by(category=4).all()]
+        res = self.client().post(
+            '/quizzes',
+            json={
+                "previous_questions": ids[:1],
+                "quiz_category": {"id": 4, "type": "History"},
+                "count": 2})
+        data = json.loads(res.data)
+        played = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(played), 2)
+        self.assertEqual(len(set(played)), 2)
+        self.assertTrue(set(played) <= set(ids[1:]))
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_play_difficulty_range(self):
+        ids = set(question.id for question in Question.query.filter(
+            Question.difficulty.between(2, 3)).all())
+        res = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [],
+                  "quiz_category": {"id": 0},
+                  "difficulty": {"min": 2, "max": 3},
+                  "plan": True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            set(question['id'] for question in data['questions']), ids)
+
+    def test_play_difficulty_ramp(self):
+        easy = [question.id for question in
+                Question.query.filter(Question.difficulty != 2).limit(2)]
+        first = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [], "quiz_category": {"id": 0},
+                  "ramp": 2})
+        later = self.client().post(
+            '/quizzes',
+            json={"previous_questions": easy, "quiz_category": {"id": 0},
+                  "ramp": 2})
+
+        self.assertEqual(json.loads(first.data)['question']['difficulty'], 1)
+        self.assertEqual(json.loads(later.data)['question']['difficulty'], 2)
+
+    def test_400_play_bad_difficulty(self):
+        res = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [], "quiz_category": {"id": 0},
+                  "difficulty": {"min": 4, "max": 2}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_play_hide_answers(self):
+        single = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [], "quiz_category": {"id": 0},
+                  "hide_answers": True})
+        batch = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [], "quiz_category": {"id": 0},
+                  "count": 3, "hide_answers": True})
+        question = json.loads(single.data)['question']
+
+        self.assertTrue(question['id'])
+        self.assertNotIn('answer', question)
+        for question in json.loads(batch.data)['questions']:
+            self.assertNotIn('answer', question)
+
+    def test_grade_answers(self):
+        question = Question('Name a prime below four', 'Two', 1, 1,
+                            answer_aliases=parse_aliases(['2', ' Three']))
+        question.insert()
+        try:
+            res = self.client().post('/quizzes/grade', json={"answers": [
+                {"id": question.id, "answer": " three!"},
+                {"id": question.id, "answer": "the TWO"},
+                {"id": question.id, "answer": "four"},
+                {"id": 100000, "answer": "two"}]})
+        finally:
+            question.delete()
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result['correct'] for result in data['results']],
+                         [True, True, False, False])
+        self.assertEqual(data['results'][0]['answer'], 'Two')
+        self.assertEqual(data['results'][3]['answer'], None)
+        self.assertEqual(data['score'], 2)
+        self.assertEqual(data['total'], 4)
+
+    def test_grade_article_answer_and_hide_aliases(self):
+        res = self.client().post('/questions', json={
+            "question": "Which vitamin do carrots hold?", "answer": "A",
+            "answer_aliases": ["retinol"], "category": 1, "difficulty": 1})
+        id = json.loads(res.data)['created']
+        try:
+            grade = self.client().post('/quizzes/grade', json={"answers": [
+                {"id": id, "answer": "a"},
+                {"id": id, "answer": "Retinol"},
+                {"id": id, "answer": "the"}]})
+            listing = self.client().get('/categories/1/questions')
+        finally:
+            Question.query.get(id).delete()
+        data = json.loads(grade.data)
+        listed = [question for question in
+                  json.loads(listing.data)['questions']
+                  if question['id'] == id]
+
+        self.assertEqual([result['correct'] for result in data['results']],
+                         [True, True, False])
+        self.assertEqual(data['results'][0]['answer'], 'A')
+        self.assertEqual(listed[0]['answer'], 'A')
+        self.assertNotIn('answer_aliases', listed[0])
+
+    def test_grade_follows_deletes(self):
+        question = Question('Which one?', 'This one', 1, 1)
+        question.insert()
+        id = question.id
+        self.client().post('/quizzes/grade', json={
+            "answers": [{"id": id, "answer": "this one"}]})
+        question.delete()
+        res = self.client().post('/quizzes/grade', json={
+            "answers": [{"id": id, "answer": "this one"}]})
+
+        self.assertFalse(json.loads(res.data)['results'][0]['correct'])
+
+    def test_400_grade_without_answers(self):
+        res = self.client().post('/quizzes/grade', json={"answers": []})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_escape_like_wildcards(self):
+        self.assertEqual(escape_like('100%_sure'), r'100\%\_sure')
+        self.assertEqual(escape_like(r'a\b'), r'a\\b')
+
+    def test_normalize_answer(self):
+        self.assertEqual(normalize_answer('The Palace of Versailles'),
+                         'palace of versailles')
+        self.assertEqual(normalize_answer(u'  Escheŕ, M.C. '),
+                         'escher m c')
+        self.assertEqual(normalize_answer('A'), 'a')
+
+    def test_play_game_plan(self):
+        ids = [question.id for question in
+               Question.query.filter_by(category=1).all()]
+        res = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [],
+                  "quiz_category": {"id": 1, "type": "Science"},
+                  "plan": True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(question['id'] for question in
+                                data['questions']), sorted(ids))
+        self.assertTrue(data['exhausted'])
+
+    def test_400_play_count_out_of_range(self):
+        res = self.client().post(
+            '/quizzes',
+            json={"previous_questions": [],
+                  "quiz_category": {"id": 0}, "count": 0})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_play_without_category(self):
+        res = self.client().post('/quizzes', json={"previous_questions": []})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_quiz_session_plays_each_question_once(self):
+        total = Question.query.filter_by(category=5).count()
+        res = self.client().post(
+            '/quizzes/sessions',
+            json={"quiz_category": {"id": 5, "type": "Entertainment"}})
+        token = json.loads(res.data)['session']
+
+        played = set()
+        for _ in range(total):
+            res = self.client().post(
+                '/quizzes/sessions/{}/next'.format(token))
+            played.add(json.loads(res.data)['question']['id'])
+        res = self.client().post('/quizzes/sessions/{}/next'.format(token))
+        data = json.loads(res.data)
+
+        self.assertEqual(len(played), total)
+        self.assertTrue(data['exhausted'])
+        self.assertEqual(data['played'], total)
+
+    def test_404_next_question_unknown_session(self):
+        res = self.client().post('/quizzes/sessions/missing/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def shed_quiz(self, limiter):
+        limiters = self.app.extensions['admission']
+        quiz = limiters['quiz']
+        limiters['quiz'] = limiter
+        limiter.acquire()
+        try:
+            return self.client().post('/quizzes', json={
+                "previous_questions": [], "quiz_category": {"id": 0}})
+        finally:
+            limiter.release()
+            limiters['quiz'] = quiz
+
+    def test_503_quiz_queue_full(self):
+        res = self.shed_quiz(AdmissionLimiter('quiz', 1, 0, 5))
+        data = json.loads(res.data)
+        metrics = self.client().get('/metrics').data.decode()
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(res.headers['Retry-After'], '5')
+        self.assertIn('trivia_admission_shed_total{class="quiz",'
+                      'reason="queue_full"}', metrics)
+
+    def test_503_quiz_wait_times_out(self):
+        res = self.shed_quiz(AdmissionLimiter('quiz', 1, 1, 0.05))
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+    def test_admission_burst(self):
+        limiter = AdmissionLimiter('burst', 2, 3, 5)
+        release = threading.Event()
+        results = []
+
+        def request():
+            admitted = limiter.acquire()
+            results.append(admitted)
+            if admitted:
+                release.wait(5)
+                limiter.release()
+
+        threads = [threading.Thread(target=request) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        # 2 RUNNING, 3 QUEUED AND THE OTHER 5 SHED STRAIGHT AWAY
+        while (limiter.waiting < 3 or results.count(False) < 5) and \
+                time.monotonic() < deadline:
+            time.sleep(0.005)
+        queued = limiter.waiting
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(queued, 3)
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(results.count(False), 5)
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_compress_list_once(self):
+        plain = self.client().get('/questions?page=1')
+        headers = {'Accept-Encoding': 'gzip'}
+        first = self.client().get('/questions?page=1', headers=headers)
+        hits = compressed_cache.hits
+        second = self.client().get('/questions?page=1', headers=headers)
+
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', first.headers['Vary'])
+        self.assertEqual(gzip.decompress(first.data), plain.data)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(compressed_cache.hits, hits + 1)
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+    def test_etag_per_encoding(self):
+        plain = self.client().get('/questions')
+        packed = self.client().get(
+            '/questions', headers={'Accept-Encoding': 'gzip'})
+        etag = packed.headers['ETag']
+        revalidated = self.client().get('/questions', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': 'W/' + etag})
+
+        self.assertNotEqual(etag, plain.headers['ETag'])
+        self.assertEqual(etag, plain.headers['ETag'][:-1] + '-gzip"')
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.headers['ETag'], etag)
+
+    def test_small_response_not_compressed(self):
+        res = self.client().get(
+            '/categories', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+
+    def assert_snapshot_serves(self, root):
+        with open(os.path.join(root, 'manifest.json')) as source:
+            manifest = json.load(source)
+        urls = {'categories.json': '/categories'}
+        for listing, pages in manifest['pages'].items():
+            for page in range(1, pages + 1):
+                urls['{}/{}.json'.format(listing, page)] = \
+                    '/{}?page={}'.format(listing, page)
+        self.assertEqual(set(urls), set(manifest['files']))
+        for name, url in urls.items():
+            with open(os.path.join(root, name)) as source:
+                self.assertEqual(json.load(source),
+                                 json.loads(self.client().get(url).data),
+                                 name)
+
+    def test_snapshot_build_and_update(self):
+        root = tempfile.mkdtemp()
+        res = self.app.test_cli_runner().invoke(
+            args=['snapshot', root, '--gzip'])
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assert_snapshot_serves(root)
+        with open(os.path.join(root, 'questions', '1.json'), 'rb') as plain:
+            with gzip.open(os.path.join(root, 'questions', '1.json.gz')) \
+                    as packed:
+                self.assertEqual(packed.read(), plain.read())
+
+        writer = self.app.extensions['snapshot_writer']
+        self.app.extensions['snapshot'] = Snapshot(root)
+        try:
+            res = self.client().post('/questions', json=self.new_question)
+            created = json.loads(res.data)['created']
+            writer.join()
+            self.assert_snapshot_serves(root)
+            res = self.client().post('/questions/batch', json={
+                "questions": [dict(self.new_question, category=category)
+                              for category in (4, 5, 5)]})
+            batch = json.loads(res.data)['created']
+            writer.join()
+            self.assert_snapshot_serves(root)
+            self.client().delete('/questions', json={
+                "ids": [created] + batch})
+            writer.join()
+            self.assert_snapshot_serves(root)
+        finally:
+            self.app.extensions['snapshot'] = None
+
+    def test_snapshot_failure_stays_out_of_the_request(self):
+        root = os.path.join(tempfile.mkdtemp(), 'not-a-directory')
+        open(root, 'w').close()
+        self.app.extensions['snapshot'] = Snapshot(root)
+        try:
+            with self.assertLogs('flaskr.snapshot', 'ERROR'):
+                res = self.client().post(
+                    '/questions', json=self.new_question)
+                self.app.extensions['snapshot_writer'].join()
+            created = json.loads(res.data)['created']
+        finally:
+            self.app.extensions['snapshot'] = None
+        self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_create_app_leaves_database_alone(self):
+        path = os.path.join(tempfile.mkdtemp(), 'untouched.db')
+        create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        db.app = self.app
+
+        # NO CONNECTION, SO SQLITE NEVER EVEN CREATED THE FILE
+        self.assertFalse(os.path.exists(path))
+
+    def test_async_reader_opens_the_app_database(self):
+        name = 'missing-{}.db'.format(os.getpid())
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + name,
+                          'SQLALCHEMY_REPLICA_URIS': ['sqlite:///' + name]})
+        db.app = self.app
+        reader = AsgiApp(app).reader
+        path = os.path.join(app.root_path, name)
+        replica = app.extensions['replicas'].engines[0]
+
+        # RELATIVE TO THE APP, NOT TO WHEREVER THE SERVER WAS STARTED
+        self.assertIn(path, reader.sqlite_uri())
+        self.assertEqual(replica.url.database, path)
+        # THE URI aiosqlite OPENS, A MISSING FILE IS AN ERROR
+        with self.assertRaises(sqlite3.OperationalError):
+            sqlite3.connect(reader.sqlite_uri(), uri=True)
+        self.assertFalse(os.path.exists(path))
+
+    def test_preload_warms_caches(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'PRELOAD_CACHES': True})
+        gc.unfreeze()
+        db.app = self.app
+
+        self.assertTrue(quiz_sampler.fresh())
+        self.assertTrue(category_cache.formatted())
+        with app.app_context():
+            self.assertEqual(question_stats.total(), Question.query.count())
+            self.assertTrue(question_stats.total())
+
+    def test_reads_go_to_replica_until_session_writes(self):
+        folder = tempfile.mkdtemp()
+        primary = 'sqlite:///' + os.path.join(folder, 'primary.db')
+        replica = 'sqlite:///' + os.path.join(folder, 'replica.db')
+        app = create_app({'SQLALCHEMY_DATABASE_URI': primary,
+                          'SQLALCHEMY_REPLICA_URIS': [replica],
+                          'DB_AUTO_UPGRADE': True})
+        try:
+            upgrade(app.extensions['replicas'].engines[0])
+            with app.app_context():
+                # A SESSION IS BOUND TO THE APP THAT OPENED IT
+                db.session.remove()
+                db.session.add(Category(type='Art'))
+                db.session.commit()
+                # THE SAME SESSION READS ITS OWN WRITE FROM THE PRIMARY
+                same_session = Category.query.count()
+                db.session.remove()
+                # BUT THE REPLICA NEVER RECEIVED THE WRITE
+                from_replica = Category.query.count()
+                db.session.remove()
+                db.session.info['primary'] = True
+                from_primary = Category.query.count()
+                db.session.remove()
+
+            client = app.test_client()
+            res = client.post('/questions', json=dict(
+                self.new_question, category=1))
+            data = json.loads(res.data)
+            cookie = res.headers.get('Set-Cookie', '')
+            # THE COOKIE KEEPS THIS CLIENT ON THE PRIMARY
+            res = client.get('/categories')
+            categories = json.loads(res.data)['categories']
+        finally:
+            db.app = self.app
+            category_cache.invalidate()
+            quiz_sampler.invalidate()
+            question_search.configure(self.app)
+
+        self.assertEqual(same_session, 1)
+        self.assertEqual(from_replica, 0)
+        self.assertEqual(from_primary, 1)
+        self.assertTrue(data['created'])
+        self.assertIn(PRIMARY_COOKIE, cookie)
+        self.assertEqual(categories, ['Art'])
+
+    def test_session_keeps_one_replica(self):
+        folder = tempfile.mkdtemp()
+        replicas = ['sqlite:///' + os.path.join(folder, name)
+                    for name in ('one.db', 'two.db')]
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'SQLALCHEMY_REPLICA_URIS': replicas})
+        try:
+            for engine in app.extensions['replicas'].engines:
+                upgrade(engine)
+            with app.app_context():
+                db.session.remove()
+                Category.query.count()
+                first = db.session.info['replica']
+                Category.query.count()
+                Question.query.count()
+                kept = db.session.info['replica']
+                db.session.remove()
+                Category.query.count()
+                next_session = db.session.info['replica']
+                db.session.remove()
+        finally:
+            db.app = self.app
+
+        self.assertIs(kept, first)
+        self.assertIsNot(next_session, first)
+
+    def test_replica_set_skips_unreachable_replica(self):
+        missing = create_engine('sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'missing', 'replica.db'))
+        healthy = create_engine('sqlite://')
+        replicas = ReplicaSet([missing, healthy], retry_after=30)
+
+        self.assertIs(replicas.pick(), healthy)
+        self.assertIs(replicas.pick(), healthy)
+        self.assertEqual(replicas.healthy(), [healthy])
+
+    def test_fresh_database_follows_every_migration(self):
+        engine = create_engine('sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'fresh.db'))
+        upgrade(engine, '0001')
+        baseline = inspect(engine)
+        baseline_keys = baseline.get_foreign_keys('questions')
+        baseline_indexes = baseline.get_indexes('questions')
+        upgrade(engine)
+        latest = inspect(engine)
+
+        self.assertEqual(baseline_keys, [])
+        self.assertEqual(baseline_indexes, [])
+        self.assertEqual(
+            [key['referred_table'] for key
+             in latest.get_foreign_keys('questions')], ['categories'])
+        self.assertIn('questions_category_id_idx', [
+            index['name'] for index in latest.get_indexes('questions')])
+
+    def test_db_upgrade(self):
+        runner = self.app.test_cli_runner()
+        runner.invoke(args=['db', 'upgrade'])
+        res = runner.invoke(args=['db', 'current'])
+        with self.app.app_context():
+            indexes = [index['name'] for index in
+                       inspect(db.engine).get_indexes('questions')]
+
+        self.assertEqual(res.output.strip(), MIGRATIONS[-1].version)
+        self.assertIn('questions_category_id_idx', indexes)
+        self.assertIn('questions_difficulty_idx', indexes)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":